@@ -1,81 +1,2887 @@
 import uvicorn
 from fastapi import FastAPI, Request, Form, HTTPException, Depends, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fasthtml import * # FastHTML components
-from fasthtml.components import Input # Explicitly import Input if needed elsewhere
+from starlette.datastructures import Headers
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException as StarletteHTTPException
+# FastHTML components by name: the star exports include a Form and File that would shadow FastAPI's
+from fasthtml.common import (A, Body, Button, Datalist, Div, H2, H3, Head, Html, Img, Input, Label, Li, Link, Meta,
+                             Option, P, Picture, Script, Small, Source, Span, Strong, Textarea, Title, Ul, to_xml)
+from fasthtml.common import Form as HtmlForm # Form is FastAPI's form field
+from fastcore.xml import NotStr # Pre-rendered HTML inside FastHTML trees
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, Union
+import asyncio
+import fcntl
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
+import math
+import mimetypes
+import mmap
 import os
+import re
+import secrets
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from bisect import bisect_left
+from html import escape
+
+try:
+    import brotli # Optional: precompressed .br assets
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image as PILImage, ImageOps # Optional: thumbnail generation
+except ImportError:
+    PILImage = ImageOps = None
+
+try:
+    import numpy as np # Optional: visual similarity
+except ImportError:
+    np = None
 
 # --- Application Setup ---
 app = FastAPI()
 
-# In-memory storage (replace with database for real app)
-users = {} # Store user sign-up info (username: {email, password}) - NOT SECURE for passwords
-images = { # Store image details
-    1: {"id": 1, "url": "https://via.placeholder.com/300x200.png?text=Image+1", "description": "A lovely placeholder", "likes": 10, "comments": ["Great shot!", "Beautiful."]},
-    2: {"id": 2, "url": "https://via.placeholder.com/300x200.png?text=Image+2", "description": "Another placeholder view", "likes": 5, "comments": ["Nice."]},
-    3: {"id": 3, "url": "https://via.placeholder.com/300x200.png?text=Image+3", "description": "Placeholder number three", "likes": 22, "comments": []},
-    4: {"id": 4, "url": "https://via.placeholder.com/300x200.png?text=Image+4", "description": "Yet another one", "likes": 1, "comments": ["Cool"]},
-    5: {"id": 5, "url": "https://via.placeholder.com/300x200.png?text=Image+5", "description": "Placeholder five", "likes": 8, "comments": []},
-    6: {"id": 6, "url": "https://via.placeholder.com/300x200.png?text=Image+6", "description": "Number six", "likes": 15, "comments": ["Wow!", "Amazing"]},
-}
-next_image_id = 7
+# Select the storage backend at startup: "memory" (default, single process) or
+# "sqlite" (durable, WAL mode, safe to share between several uvicorn workers)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "memory")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "pinterest.db")
+
+# Signs the session cookie. Set it explicitly when running several workers (or to keep
+# users signed in across restarts), otherwise each process picks its own random key and
+# users have to log in again after a restart
+SESSION_SECRET = os.environ.get("SESSION_SECRET") or secrets.token_hex(32)
+SESSION_COOKIE = "session"
+SESSION_MAX_AGE = 30 * 24 * 3600
+
+FEED_PAGE_SIZE = 30 # Images per feed page
+FEED_MAX_PAGE_SIZE = 100
+PAGE_CACHE_ENTRIES = 512 # Rendered feed pages kept per worker
+PAGE_CACHE_BYTES = 16 * 1024 * 1024
+SYNC_INTERVAL = 0.1 # Requests check the store for other workers' changes at most this often
+COMMENTS_PAGE_SIZE = 20 # Comments per "load more" page, newest first
+COMMENT_SEGMENT_BYTES = 4 * 1024 * 1024 # Comment log segment files roll over at this size
+COMMENT_HOT_SEGMENTS = 4 # Sealed comment log segments kept memory-mapped
+COMMENT_SYNC_BATCH = 500 # Comments fetched per query when catching up with other workers
+ROARING_ARRAY_MAX = 4096 # Like sets: user ids per 16-bit chunk before a sorted array becomes a bitmap
+
+# CSS widths the images are displayed at, used for srcset selection
+FEED_IMAGE_WIDTH = 236
+FEED_IMAGE_SIZES = "(max-width: 600px) 50vw, 236px"
+DETAIL_IMAGE_WIDTH = 540
+DETAIL_IMAGE_SIZES = "(max-width: 900px) 100vw, 540px"
+
+# Seed data loaded into an empty store
+SEED_IMAGES = [
+    {"url": "https://via.placeholder.com/300x200.png?text=Image+1", "description": "A lovely placeholder", "likes": 10, "comments": ["Great shot!", "Beautiful."]},
+    {"url": "https://via.placeholder.com/300x200.png?text=Image+2", "description": "Another placeholder view", "likes": 5, "comments": ["Nice."]},
+    {"url": "https://via.placeholder.com/300x200.png?text=Image+3", "description": "Placeholder number three", "likes": 22, "comments": []},
+    {"url": "https://via.placeholder.com/300x200.png?text=Image+4", "description": "Yet another one", "likes": 1, "comments": ["Cool"]},
+    {"url": "https://via.placeholder.com/300x200.png?text=Image+5", "description": "Placeholder five", "likes": 8, "comments": []},
+    {"url": "https://via.placeholder.com/300x200.png?text=Image+6", "description": "Number six", "likes": 15, "comments": ["Wow!", "Amazing"]},
+]
+
+# --- Storage Backends ---
+
+class Repository:
+    """Storage interface used by the handlers. Image records read like dicts with
+    id, url, description, likes, comments, blob (object store digest or None),
+    width/height (intrinsic size, None if unknown), owner (uploader's user id, None for
+    seed and anonymous uploads) and variants ("<format>-<width>": URL, filled in once
+    background resizing finishes) keys."""
+
+    blocking = False # True when calls can wait on disk or on other processes' locks
+
+    async def run(self, fn, *args, **kwargs):
+        """Await a call to one of this repository's methods. Blocking backends run it on
+        the thread pool so lock waits never stall the event loop; in-memory calls run inline."""
+        if self.blocking:
+            return await run_in_threadpool(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    def get_image(self, image_id: int, with_comments: bool = True) -> Optional[Dict]:
+        """Image record; the comments key is only filled in when with_comments is set"""
+        raise NotImplementedError
+
+    def add_image(self, url: str, description: str, likes: int = 0, comments: Optional[List[str]] = None,
+                  blob: Optional[str] = None, width: Optional[int] = None, height: Optional[int] = None,
+                  owner: Optional[int] = None) -> int:
+        """Store a new image and return its id"""
+        raise NotImplementedError
+
+    def delete_image(self, image_id: int) -> Optional[Dict]:
+        """Remove an image and its comments, return the removed record or None if missing.
+        The id is appended to the deletion log read by deletions_after."""
+        raise NotImplementedError
+
+    def deletions_after(self, seq: int) -> List[tuple]:
+        """(seq, image_id) for images deleted after position seq of the deletion log, in
+        deletion order; used to catch up with other workers' deletes"""
+        raise NotImplementedError
+
+    def image_ids(self) -> List[int]:
+        raise NotImplementedError
+
+    def image_ids_after(self, image_id: int) -> List[int]:
+        """Ids greater than image_id in ascending order, used to catch up with other workers' uploads"""
+        raise NotImplementedError
+
+    def get_images(self, image_ids: List[int]) -> List[Dict]:
+        """Feed records (id, url, description, likes, width, height, variants) for the given ids, in the same order"""
+        raise NotImplementedError
+
+    def set_variants(self, image_id: int, variants: Dict[str, str]) -> bool:
+        """Record generated variant URLs, return False if the image is gone"""
+        raise NotImplementedError
+
+    def feed_version(self) -> int:
+        """Counter that moves whenever feed pages change (image added or deleted, variants
+        recorded), whichever worker made the change"""
+        raise NotImplementedError
+
+    def set_features(self, image_id: int, features: bytes) -> bool:
+        """Store an image's similarity feature vector (raw float32), return False if the image is gone"""
+        raise NotImplementedError
+
+    def get_features(self, image_id: int) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def iter_features(self) -> Iterator[tuple]:
+        """(image_id, feature bytes) for every image that has a feature vector"""
+        raise NotImplementedError
+
+    def set_phash(self, image_id: int, phash: int) -> bool:
+        """Store an image's 64-bit perceptual hash, return False if the image is gone"""
+        raise NotImplementedError
+
+    def get_phash(self, image_id: int) -> Optional[int]:
+        raise NotImplementedError
+
+    def iter_phashes(self) -> Iterator[tuple]:
+        """(image_id, perceptual hash) for every image that has one"""
+        raise NotImplementedError
+
+    def image_with_variants(self, blob: str) -> Optional[Dict]:
+        """An image (id and variants at least) stored under blob whose variants are done, or None"""
+        raise NotImplementedError
+
+    def iter_images(self, with_comments: bool = True) -> Iterator[Dict]:
+        """Every image record, in id order; used to build in-process indexes"""
+        for image_id in sorted(self.image_ids()):
+            img = self.get_image(image_id, with_comments)
+            if img is not None:
+                yield img
+
+    def apply_like_changes(self, changes: Dict[tuple, bool]) -> Dict[int, int]:
+        """Record (image_id, user_id): liked states. Counts only move for likes that were
+        actually added or removed; return the new count per image (missing images are left out)"""
+        raise NotImplementedError
+
+    def is_liked(self, image_id: int, user_id: int) -> bool:
+        raise NotImplementedError
+
+    def iter_likes(self) -> Iterator[tuple]:
+        """(image_id, user_id) for every like, used to build the in-process like sets"""
+        raise NotImplementedError
+
+    def add_comment(self, image_id: int, comment: str, author: Optional[str] = None) -> Optional[Dict]:
+        """Append a comment, return it or None if the image is missing. Comment records have
+        id (increasing in posting order), body, author (username or None) and created_at keys."""
+        raise NotImplementedError
+
+    def get_comments(self, image_id: int, before: Optional[int] = None, limit: int = COMMENTS_PAGE_SIZE) -> Optional[List[Dict]]:
+        """Up to limit comments with ids below before, newest first; None if the image is missing"""
+        raise NotImplementedError
+
+    def comments_after(self, comment_id: int, limit: int = COMMENT_SYNC_BATCH) -> List[tuple]:
+        """(image_id, comment) for up to limit comments with ids above comment_id (-1 for all),
+        in posting order; used to catch up with comments posted through other workers"""
+        raise NotImplementedError
+
+    def get_user(self, username: str) -> Optional[Dict]:
+        """User record (id, email, password) or None"""
+        raise NotImplementedError
+
+    def get_username(self, user_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    def add_user(self, username: str, email: str, password: str) -> Optional[int]:
+        """Create a user, return the new integer user id or None if the username is taken"""
+        raise NotImplementedError
+
+    def add_blob_ref(self, digest: str, size: int) -> int:
+        """Count one more image referencing a blob, return the new reference count"""
+        raise NotImplementedError
+
+    def release_blob(self, digest: str) -> int:
+        """Drop one reference to a blob, return the remaining count (the entry is removed at zero)"""
+        raise NotImplementedError
+
+    def blob_stats(self) -> Dict:
+        """Blob and reference counts, plus bytes on disk vs bytes as uploaded"""
+        raise NotImplementedError
+
+    def seed(self):
+        """Load the placeholder images into an empty store"""
+        if not self.image_ids():
+            for img in SEED_IMAGES:
+                self.add_image(img["url"], img["description"], img["likes"], img["comments"])
+
+
+IMAGE_FIELDS = ("id", "url", "description", "likes", "blob", "width", "height", "owner", "variants")
+
+class ImageRecord:
+    """Compact in-memory image record. Slots instead of a per-image dict, no variants
+    dict until the image has some, and comments kept in the CommentLog. Reads like
+    the dict records (record['likes'], dict(record))."""
+    __slots__ = IMAGE_FIELDS
+
+    def __init__(self, image_id: int, url: str, description: str, likes: int = 0,
+                 blob: Optional[str] = None, width: Optional[int] = None, height: Optional[int] = None,
+                 owner: Optional[int] = None):
+        self.id = image_id
+        self.url = url
+        self.description = description
+        self.likes = likes
+        self.blob = blob
+        self.width = width
+        self.height = height
+        self.owner = owner
+        self.variants = None
+
+    def __getitem__(self, key: str):
+        if key == "variants":
+            return self.variants or {}
+        if key not in IMAGE_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return self[key] if key in IMAGE_FIELDS else default
+
+    def keys(self):
+        return IMAGE_FIELDS
+
+
+class CommentLog:
+    """Append-only comment log in segment files of about COMMENT_SEGMENT_BYTES. A comment's
+    id is its position, (segment << 32) | offset, so ids grow in posting order and locate
+    the record directly. Each record links to the previous comment on the same image, so
+    a page is a walk back from the image's newest comment: O(1) appends, O(page) reads.
+    Memory holds one head position and count per image; text stays on disk, with only
+    the COMMENT_HOT_SEGMENTS most recently read sealed segments memory-mapped.
+
+    Clients send positions back as "load more" cursors, so every record starts with a
+    MAC over its position and contents under a per-log random key: only a record this
+    log wrote, read at the position it was written to, is followed."""
+
+    TAG_SIZE = 8
+    HEADER = struct.Struct("<qqdHI") # After the tag: image_id, previous position (-1: none), created_at, author bytes, body bytes
+
+    def __init__(self, directory: str, segment_bytes: int = COMMENT_SEGMENT_BYTES, hot_segments: int = COMMENT_HOT_SEGMENTS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.hot_segments = hot_segments
+        self.heads: Dict[int, int] = {} # image_id: position of its newest comment
+        self.counts: Dict[int, int] = {}
+        self.hot = OrderedDict() # segment number: mmap, least recently read first
+        self.lock = threading.Lock()
+        self.key = secrets.token_bytes(32) # Heads live in memory, so only this instance ever reads the log
+        self.segment = 0
+        self.size = 0 # Bytes in the active segment
+        self.fd = self.open_segment(0)
+
+    def path_for(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:08d}.log")
+
+    def open_segment(self, segment: int) -> int:
+        return os.open(self.path_for(segment), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def tag(self, position: int, record: bytes) -> bytes:
+        mac = hashlib.blake2b(key=self.key, digest_size=self.TAG_SIZE)
+        mac.update(position.to_bytes(8, "little"))
+        mac.update(record)
+        return mac.digest()
+
+    def append(self, image_id: int, body: str, author: Optional[str] = None, created_at: Optional[float] = None) -> Dict:
+        author_bytes, body_bytes = (author or "").encode(), body.encode()
+        created_at = created_at or time.time()
+        with self.lock:
+            record = self.HEADER.pack(image_id, self.heads.get(image_id, -1), created_at, len(author_bytes), len(body_bytes))
+            record += author_bytes + body_bytes
+            if self.size and self.size + self.TAG_SIZE + len(record) > self.segment_bytes: # Seal the segment, start the next
+                os.close(self.fd)
+                self.segment += 1
+                self.fd = self.open_segment(self.segment)
+                self.size = 0
+            position = self.segment << 32 | self.size
+            os.write(self.fd, self.tag(position, record) + record)
+            self.size += self.TAG_SIZE + len(record)
+            self.heads[image_id] = position
+            self.counts[image_id] = self.counts.get(image_id, 0) + 1
+        return {"id": position, "body": body, "author": author, "created_at": created_at}
+
+    def mapped(self, segment: int) -> mmap.mmap:
+        data = self.hot.pop(segment, None)
+        if data is None:
+            with open(self.path_for(segment), "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(self.hot) >= self.hot_segments:
+                self.hot.popitem(last=False)[1].close()
+        self.hot[segment] = data
+        return data
+
+    def read(self, position: int) -> Optional[tuple]:
+        """(image_id, previous position, comment, next position) at position, or None if no record starts there"""
+        segment, offset = position >> 32, position & 0xFFFFFFFF
+        header_size = self.TAG_SIZE + self.HEADER.size
+        with self.lock:
+            if position < 0 or segment > self.segment:
+                return None
+            if segment == self.segment:
+                if offset + header_size > self.size:
+                    return None
+                head = os.pread(self.fd, header_size, offset)
+                image_id, prev, created_at, author_len, body_len = self.HEADER.unpack_from(head, self.TAG_SIZE)
+                if offset + header_size + author_len + body_len > self.size: # Don't let a bogus length size the read
+                    return None
+                payload = os.pread(self.fd, author_len + body_len, offset + header_size)
+            else:
+                data = self.mapped(segment)
+                if offset + header_size > len(data):
+                    return None
+                head = data[offset:offset + header_size]
+                image_id, prev, created_at, author_len, body_len = self.HEADER.unpack_from(head, self.TAG_SIZE)
+                payload = data[offset + header_size:offset + header_size + author_len + body_len]
+        if len(payload) != author_len + body_len or not hmac.compare_digest(head[:self.TAG_SIZE], self.tag(position, head[self.TAG_SIZE:] + payload)):
+            return None
+        author = payload[:author_len].decode(errors="replace") or None
+        comment = {"id": position, "body": payload[author_len:].decode(errors="replace"), "author": author, "created_at": created_at}
+        return image_id, prev, comment, position + header_size + author_len + body_len
+
+    def page(self, image_id: int, before: Optional[int] = None, limit: int = COMMENTS_PAGE_SIZE) -> List[Dict]:
+        """Up to limit comments older than the before cursor (a comment id), newest first"""
+        position = self.heads.get(image_id, -1)
+        if before is not None:
+            cursor = self.read(before)
+            position = cursor[1] if cursor is not None and cursor[0] == image_id else -1
+        comments = []
+        while position >= 0 and len(comments) < limit:
+            record = self.read(position)
+            if record is None or record[0] != image_id:
+                break
+            comments.append(record[2])
+            position = record[1]
+        return comments
+
+    def scan(self, after: int = -1, limit: int = COMMENT_SYNC_BATCH) -> List[tuple]:
+        """(image_id, comment) for up to limit records written after position after (-1 for
+        all), oldest first. A sequential read; records of dropped images are skipped."""
+        position = 0
+        if after >= 0:
+            record = self.read(after)
+            if record is None:
+                return []
+            position = record[3]
+        records = []
+        while len(records) < limit:
+            record = self.read(position)
+            if record is None:
+                if position >> 32 < self.segment: # End of a sealed segment
+                    position = ((position >> 32) + 1) << 32
+                    continue
+                break
+            image_id, _, comment, position = record
+            if image_id in self.heads:
+                records.append((image_id, comment))
+        return records
+
+    def bodies(self, image_id: int) -> List[str]:
+        """Every comment body of an image, oldest first"""
+        return [c["body"] for c in reversed(self.page(image_id, limit=self.counts.get(image_id, 0)))]
+
+    def drop(self, image_id: int):
+        # The records stay in their segments; only the image's chain is forgotten
+        self.heads.pop(image_id, None)
+        self.counts.pop(image_id, None)
+
+
+class RoaringSet:
+    """Compact set of non-negative ints in the style of a roaring bitmap. Ids are grouped
+    by their high 16 bits; each group is a sorted array('H') of the low bits (2 bytes per
+    id instead of a set entry's ~60) until it holds ROARING_ARRAY_MAX ids, then an 8 KiB
+    bitmap. Membership is a bit test, or a bisect over at most 4096 entries."""
+    __slots__ = ("containers", "size")
+
+    def __init__(self, values=()):
+        self.containers: Dict[int, object] = {} # high 16 bits: array('H') or bytearray bitmap
+        self.size = 0
+        for value in values:
+            self.add(value)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[int]:
+        for high, container in sorted(self.containers.items()):
+            if isinstance(container, bytearray):
+                lows = (low for low in range(65536) if container[low >> 3] & (1 << (low & 7)))
+            else:
+                lows = iter(container)
+            for low in lows:
+                yield high << 16 | low
+
+    def __contains__(self, value: int) -> bool:
+        container = self.containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, bytearray):
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        pos = bisect_left(container, low)
+        return pos < len(container) and container[pos] == low
+
+    def add(self, value: int) -> bool:
+        """Add value, return False if it was already present"""
+        high, low = value >> 16, value & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = array("H", (low,))
+        elif isinstance(container, bytearray):
+            if container[low >> 3] & (1 << (low & 7)):
+                return False
+            container[low >> 3] |= 1 << (low & 7)
+        else:
+            pos = bisect_left(container, low)
+            if pos < len(container) and container[pos] == low:
+                return False
+            container.insert(pos, low)
+            if len(container) > ROARING_ARRAY_MAX:
+                bitmap = bytearray(8192)
+                for member in container:
+                    bitmap[member >> 3] |= 1 << (member & 7)
+                self.containers[high] = bitmap
+        self.size += 1
+        return True
+
+    def discard(self, value: int) -> bool:
+        """Remove value, return False if it was not present"""
+        high, low = value >> 16, value & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            return False
+        if isinstance(container, bytearray):
+            # Bitmaps are not shrunk back into arrays; a chunk that got this dense stays dense
+            if not container[low >> 3] & (1 << (low & 7)):
+                return False
+            container[low >> 3] &= ~(1 << (low & 7)) & 0xFF
+        else:
+            pos = bisect_left(container, low)
+            if pos == len(container) or container[pos] != low:
+                return False
+            del container[pos]
+            if not container:
+                del self.containers[high]
+        self.size -= 1
+        return True
+
+
+class LikeIndex:
+    """Which users liked which image, one RoaringSet of user ids per image. The in-memory
+    store keeps its likes in one. Workers on a shared store keep one as a cache of states
+    the store confirmed, which misses likes made through other workers until it is told."""
+
+    def __init__(self):
+        self.likers: Dict[int, RoaringSet] = {}
+
+    def rebuild(self, likes: Iterator[tuple]):
+        self.likers = {}
+        for image_id, user_id in likes:
+            self.likers.setdefault(image_id, RoaringSet()).add(user_id)
+
+    def liked(self, image_id: int, user_id: int) -> bool:
+        likers = self.likers.get(image_id)
+        return likers is not None and user_id in likers
+
+    def set_liked(self, image_id: int, user_id: int, liked: bool) -> bool:
+        """Like or unlike, return False if the user's state did not change"""
+        if liked:
+            return self.likers.setdefault(image_id, RoaringSet()).add(user_id)
+        likers = self.likers.get(image_id)
+        return likers is not None and likers.discard(user_id)
+
+    def remove(self, image_id: int):
+        self.likers.pop(image_id, None)
+
+    def __iter__(self) -> Iterator[tuple]:
+        """(image_id, user_id) for every like"""
+        for image_id, likers in list(self.likers.items()):
+            for user_id in likers:
+                yield image_id, user_id
+
+
+class InMemoryRepository(Repository):
+    """Plain dicts, state is lost on restart and not shared between workers.
+    Comments go to a CommentLog in a temporary directory rather than RAM."""
+
+    def __init__(self):
+        self.users = {} # username: {id, email, password} - NOT SECURE for passwords
+        self.usernames = {} # user_id: username
+        self.images = {} # image_id: ImageRecord
+        self.comment_dir = tempfile.TemporaryDirectory(prefix="comments-") # Removed with the repository
+        self.comments = CommentLog(self.comment_dir.name)
+        self.blobs = {} # digest: [size, refcount]
+        self.features = {} # image_id: float32 feature vector bytes
+        self.phashes = {} # image_id: 64-bit perceptual hash
+        self.likes = LikeIndex()
+        self.deletions = [] # Deleted image ids, see deletions_after
+        self.next_image_id = 1
+        self.next_user_id = 1
+        self.version = 0 # See feed_version
+
+    def get_image(self, image_id: int, with_comments: bool = True) -> Optional[Dict]:
+        img = self.images.get(image_id)
+        if img is None or not with_comments:
+            return img
+        return {**img, "comments": self.comments.bodies(image_id)}
+
+    def add_image(self, url: str, description: str, likes: int = 0, comments: Optional[List[str]] = None,
+                  blob: Optional[str] = None, width: Optional[int] = None, height: Optional[int] = None,
+                  owner: Optional[int] = None) -> int:
+        new_id = self.next_image_id
+        self.images[new_id] = ImageRecord(new_id, url, description, likes, blob, width, height, owner)
+        for comment in comments or []:
+            self.comments.append(new_id, comment)
+        self.next_image_id += 1
+        self.version += 1
+        return new_id
+
+    def delete_image(self, image_id: int) -> Optional[Dict]:
+        self.features.pop(image_id, None)
+        self.phashes.pop(image_id, None)
+        self.likes.remove(image_id)
+        img = self.get_image(image_id)
+        self.comments.drop(image_id)
+        if self.images.pop(image_id, None) is not None:
+            self.deletions.append(image_id)
+            self.version += 1
+        return img
+
+    def deletions_after(self, seq: int) -> List[tuple]:
+        return [(i + 1, image_id) for i, image_id in enumerate(self.deletions[seq:], seq)]
+
+    def image_ids(self) -> List[int]:
+        return list(self.images.keys())
+
+    def image_ids_after(self, image_id: int) -> List[int]:
+        # Ids are assigned in increasing order, so only the tail of the dict is scanned
+        newer = list(itertools.takewhile(lambda i: i > image_id, reversed(self.images)))
+        return newer[::-1]
+
+    def get_images(self, image_ids: List[int]) -> List[Dict]:
+        return [self.images[i] for i in image_ids if i in self.images]
+
+    def iter_images(self, with_comments: bool = True) -> Iterator[Dict]:
+        return (self.get_image(image_id, with_comments) for image_id in list(self.images))
+
+    def set_features(self, image_id: int, features: bytes) -> bool:
+        if image_id not in self.images:
+            return False
+        self.features[image_id] = features
+        return True
+
+    def get_features(self, image_id: int) -> Optional[bytes]:
+        return self.features.get(image_id)
+
+    def iter_features(self) -> Iterator[tuple]:
+        return iter(list(self.features.items()))
+
+    def set_phash(self, image_id: int, phash: int) -> bool:
+        if image_id not in self.images:
+            return False
+        self.phashes[image_id] = phash
+        return True
+
+    def get_phash(self, image_id: int) -> Optional[int]:
+        return self.phashes.get(image_id)
+
+    def iter_phashes(self) -> Iterator[tuple]:
+        return iter(list(self.phashes.items()))
+
+    def image_with_variants(self, blob: str) -> Optional[Dict]:
+        # A scan, but it only runs for uploads that were deduplicated
+        return next((img for img in self.images.values() if img.blob == blob and img.variants), None)
+
+    def set_variants(self, image_id: int, variants: Dict[str, str]) -> bool:
+        img = self.images.get(image_id)
+        if img is None:
+            return False
+        img.variants = dict(variants) or None
+        self.version += 1
+        return True
+
+    def feed_version(self) -> int:
+        return self.version
+
+    def apply_like_changes(self, changes: Dict[tuple, bool]) -> Dict[int, int]:
+        results = {}
+        for (image_id, user_id), liked in changes.items():
+            img = self.images.get(image_id)
+            if img is None:
+                continue
+            if self.likes.set_liked(image_id, user_id, liked):
+                img.likes = max(img.likes + (1 if liked else -1), 0)
+            results[image_id] = img.likes
+        return results
+
+    def is_liked(self, image_id: int, user_id: int) -> bool:
+        return self.likes.liked(image_id, user_id)
+
+    def iter_likes(self) -> Iterator[tuple]:
+        return iter(self.likes)
+
+    def add_comment(self, image_id: int, comment: str, author: Optional[str] = None) -> Optional[Dict]:
+        if image_id not in self.images:
+            return None
+        return self.comments.append(image_id, comment, author)
+
+    def get_comments(self, image_id: int, before: Optional[int] = None, limit: int = COMMENTS_PAGE_SIZE) -> Optional[List[Dict]]:
+        if image_id not in self.images:
+            return None
+        return self.comments.page(image_id, before, limit)
+
+    def comments_after(self, comment_id: int, limit: int = COMMENT_SYNC_BATCH) -> List[tuple]:
+        return self.comments.scan(comment_id, limit)
+
+    def get_user(self, username: str) -> Optional[Dict]:
+        return self.users.get(username)
+
+    def get_username(self, user_id: int) -> Optional[str]:
+        return self.usernames.get(user_id)
+
+    def add_user(self, username: str, email: str, password: str) -> Optional[int]:
+        if username in self.users:
+            return None
+        user_id = self.next_user_id
+        self.users[username] = {"id": user_id, "email": email, "password": password}
+        self.usernames[user_id] = username
+        self.next_user_id += 1
+        return user_id
+
+    def add_blob_ref(self, digest: str, size: int) -> int:
+        entry = self.blobs.setdefault(digest, [size, 0])
+        entry[1] += 1
+        return entry[1]
+
+    def release_blob(self, digest: str) -> int:
+        entry = self.blobs.get(digest)
+        if entry is None:
+            return 0
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self.blobs[digest]
+            return 0
+        return entry[1]
+
+    def blob_stats(self) -> Dict:
+        return {
+            "blobs": len(self.blobs),
+            "references": sum(refs for _, refs in self.blobs.values()),
+            "physical_bytes": sum(size for size, _ in self.blobs.values()),
+            "logical_bytes": sum(size * refs for size, refs in self.blobs.values()),
+        }
+
+
+class SQLiteRepository(Repository):
+    """SQLite in WAL mode, so several worker processes can read while one writes"""
+
+    blocking = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            description TEXT NOT NULL,
+            likes INTEGER NOT NULL DEFAULT 0,
+            blob TEXT,
+            width INTEGER,
+            height INTEGER,
+            owner INTEGER REFERENCES users(id), -- Uploader, NULL for seed and anonymous uploads
+            variants TEXT NOT NULL DEFAULT '{}' -- JSON object, variant name: URL
+        );
+        CREATE INDEX IF NOT EXISTS images_blob ON images(blob);
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            image_id INTEGER NOT NULL REFERENCES images(id),
+            body TEXT NOT NULL,
+            author TEXT, -- Username, NULL for anonymous comments
+            created_at REAL NOT NULL DEFAULT 0 -- Unix time
+        );
+        CREATE INDEX IF NOT EXISTS comments_image_id ON comments(image_id, id);
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS likes (
+            image_id INTEGER NOT NULL REFERENCES images(id),
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            PRIMARY KEY (image_id, user_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS image_features (
+            image_id INTEGER PRIMARY KEY REFERENCES images(id),
+            vector BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS image_phashes (
+            image_id INTEGER PRIMARY KEY REFERENCES images(id),
+            phash INTEGER NOT NULL -- Stored signed, SQLite integers are 64-bit signed
+        );
+        CREATE TABLE IF NOT EXISTS blobs (
+            digest TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS deleted_images (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, -- Position in the deletion log
+            image_id INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY, -- 'feed': see feed_version
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path: str):
+        # Autocommit mode; each statement is its own transaction unless wrapped explicitly
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000") # Wait for other workers' write locks
+        self.conn.executescript(self.SCHEMA)
+        self.fold_like_shards()
+
+    def fold_like_shards(self):
+        """Databases written by earlier versions may keep part of a like count in a like_shards
+        table; add it back into images.likes and drop the table"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'like_shards'").fetchone():
+                    self.conn.execute(
+                        "UPDATE images SET likes = MAX(likes + (SELECT SUM(s.likes) FROM like_shards s WHERE s.image_id = images.id), 0) "
+                        "WHERE id IN (SELECT image_id FROM like_shards)"
+                    )
+                    self.conn.execute("DROP TABLE like_shards")
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_image(self, image_id: int, with_comments: bool = True) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT id, url, description, likes, blob, width, height, owner, variants FROM images WHERE id = ?", (image_id,)).fetchone()
+            if row is None:
+                return None
+            if not with_comments:
+                return self.image_row(row)
+            comments = [r[0] for r in self.conn.execute("SELECT body FROM comments WHERE image_id = ? ORDER BY id", (image_id,))]
+        return {**self.image_row(row), "comments": comments}
+
+    @staticmethod
+    def image_row(row: sqlite3.Row) -> Dict:
+        img = dict(row)
+        img["variants"] = json.loads(img["variants"])
+        return img
+
+    def add_image(self, url: str, description: str, likes: int = 0, comments: Optional[List[str]] = None,
+                  blob: Optional[str] = None, width: Optional[int] = None, height: Optional[int] = None,
+                  owner: Optional[int] = None) -> int:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                new_id = self.insert_image(url, description, likes, comments, blob, width, height, owner)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return new_id
+
+    def insert_image(self, url: str, description: str, likes: int = 0, comments: Optional[List[str]] = None,
+                     blob: Optional[str] = None, width: Optional[int] = None, height: Optional[int] = None,
+                     owner: Optional[int] = None) -> int:
+        """Insert an image and its comments inside an open write transaction, return its id"""
+        cur = self.conn.execute(
+            "INSERT INTO images (url, description, likes, blob, width, height, owner) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, description, likes, blob, width, height, owner)
+        )
+        new_id = cur.lastrowid
+        now = time.time()
+        self.conn.executemany("INSERT INTO comments (image_id, body, created_at) VALUES (?, ?, ?)", [(new_id, c, now) for c in comments or []])
+        self.bump_feed_version()
+        return new_id
+
+    def bump_feed_version(self):
+        """Move the feed version inside an open write transaction"""
+        self.conn.execute("INSERT INTO counters (name, value) VALUES ('feed', 1) ON CONFLICT(name) DO UPDATE SET value = value + 1")
+
+    def feed_version(self) -> int:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM counters WHERE name = 'feed'").fetchone()
+        return row[0] if row else 0
+
+    def seed(self):
+        # Check and insert in one write transaction: workers started together on an empty
+        # database would otherwise all see it empty and each load the placeholders
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.conn.execute("SELECT 1 FROM images LIMIT 1").fetchone() is None:
+                    for img in SEED_IMAGES:
+                        self.insert_image(img["url"], img["description"], img["likes"], img["comments"])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def delete_image(self, image_id: int) -> Optional[Dict]:
+        img = self.get_image(image_id)
+        if img is None:
+            return None
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM comments WHERE image_id = ?", (image_id,))
+                self.conn.execute("DELETE FROM image_features WHERE image_id = ?", (image_id,))
+                self.conn.execute("DELETE FROM image_phashes WHERE image_id = ?", (image_id,))
+                self.conn.execute("DELETE FROM likes WHERE image_id = ?", (image_id,))
+                deleted = self.conn.execute("DELETE FROM images WHERE id = ?", (image_id,)).rowcount
+                if deleted:
+                    self.conn.execute("INSERT INTO deleted_images (image_id) VALUES (?)", (image_id,))
+                    self.bump_feed_version()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return img if deleted else None # Another worker may have deleted it first
+
+    def deletions_after(self, seq: int) -> List[tuple]:
+        with self.lock:
+            return self.conn.execute("SELECT seq, image_id FROM deleted_images WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+
+    def image_ids(self) -> List[int]:
+        with self.lock:
+            return [r[0] for r in self.conn.execute("SELECT id FROM images")]
+
+    def image_ids_after(self, image_id: int) -> List[int]:
+        with self.lock:
+            return [r[0] for r in self.conn.execute("SELECT id FROM images WHERE id > ? ORDER BY id", (image_id,))]
+
+    def get_images(self, image_ids: List[int]) -> List[Dict]:
+        if not image_ids:
+            return []
+        placeholders = ",".join("?" * len(image_ids))
+        with self.lock:
+            rows = self.conn.execute(f"SELECT id, url, description, likes, width, height, variants FROM images WHERE id IN ({placeholders})", image_ids)
+            by_id = {r["id"]: self.image_row(r) for r in rows}
+        return [by_id[i] for i in image_ids if i in by_id]
+
+    def iter_images(self, with_comments: bool = True) -> Iterator[Dict]:
+        # Two ordered scans merged in Python instead of one comments query per image
+        with self.lock:
+            images = [self.image_row(r) for r in self.conn.execute("SELECT id, url, description, likes, blob, width, height, variants FROM images ORDER BY id")]
+            comments = self.conn.execute("SELECT image_id, body FROM comments ORDER BY image_id, id").fetchall() if with_comments else None
+        if comments is None:
+            yield from images
+            return
+        by_image = itertools.groupby(comments, key=lambda r: r[0])
+        pending = next(by_image, None)
+        for img in images:
+            while pending is not None and pending[0] < img["id"]:
+                pending = next(by_image, None)
+            if pending is not None and pending[0] == img["id"]:
+                img["comments"] = [r[1] for r in pending[1]]
+                pending = next(by_image, None)
+            else:
+                img["comments"] = []
+            yield img
+
+    def set_features(self, image_id: int, features: bytes) -> bool:
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT OR REPLACE INTO image_features (image_id, vector) SELECT id, ? FROM images WHERE id = ?",
+                (features, image_id)
+            )
+        return cur.rowcount > 0
+
+    def get_features(self, image_id: int) -> Optional[bytes]:
+        with self.lock:
+            row = self.conn.execute("SELECT vector FROM image_features WHERE image_id = ?", (image_id,)).fetchone()
+        return row[0] if row else None
+
+    def iter_features(self) -> Iterator[tuple]:
+        with self.lock:
+            rows = self.conn.execute("SELECT image_id, vector FROM image_features ORDER BY image_id").fetchall()
+        return iter(rows)
+
+    def set_phash(self, image_id: int, phash: int) -> bool:
+        signed = phash - (1 << 64) if phash >= 1 << 63 else phash
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT OR REPLACE INTO image_phashes (image_id, phash) SELECT id, ? FROM images WHERE id = ?",
+                (signed, image_id)
+            )
+        return cur.rowcount > 0
+
+    def get_phash(self, image_id: int) -> Optional[int]:
+        with self.lock:
+            row = self.conn.execute("SELECT phash FROM image_phashes WHERE image_id = ?", (image_id,)).fetchone()
+        return row[0] & (1 << 64) - 1 if row else None
+
+    def iter_phashes(self) -> Iterator[tuple]:
+        with self.lock:
+            rows = self.conn.execute("SELECT image_id, phash FROM image_phashes").fetchall()
+        return iter((image_id, phash & (1 << 64) - 1) for image_id, phash in rows)
+
+    def image_with_variants(self, blob: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT id, variants FROM images WHERE blob = ? AND variants != '{}' LIMIT 1", (blob,)).fetchone()
+        return self.image_row(row) if row else None
+
+    def set_variants(self, image_id: int, variants: Dict[str, str]) -> bool:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = self.conn.execute("UPDATE images SET variants = ? WHERE id = ?", (json.dumps(variants), image_id)).rowcount
+                if updated:
+                    self.bump_feed_version()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return updated > 0
+
+    def apply_like_changes(self, changes: Dict[tuple, bool]) -> Dict[int, int]:
+        # One write transaction (and one WAL commit) for the whole batch. The like rows
+        # decide the deltas, so a user who liked the same pin from two workers counts once
+        deltas: Dict[int, int] = {}
+        results = {}
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for (image_id, user_id), liked in changes.items():
+                    if liked:
+                        changed = self.conn.execute(
+                            "INSERT OR IGNORE INTO likes (image_id, user_id) SELECT id, ? FROM images WHERE id = ?", (user_id, image_id)
+                        ).rowcount
+                    else:
+                        changed = -self.conn.execute("DELETE FROM likes WHERE image_id = ? AND user_id = ?", (image_id, user_id)).rowcount
+                    deltas[image_id] = deltas.get(image_id, 0) + changed
+                for image_id, delta in deltas.items():
+                    row = self.conn.execute(
+                        "UPDATE images SET likes = MAX(likes + ?, 0) WHERE id = ? RETURNING likes", (delta, image_id)
+                    ).fetchone()
+                    if row:
+                        results[image_id] = row[0]
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return results
+
+    def is_liked(self, image_id: int, user_id: int) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM likes WHERE image_id = ? AND user_id = ?", (image_id, user_id)).fetchone() is not None
+
+    def iter_likes(self) -> Iterator[tuple]:
+        with self.lock:
+            rows = self.conn.execute("SELECT image_id, user_id FROM likes").fetchall()
+        return iter(rows)
+
+    def add_comment(self, image_id: int, comment: str, author: Optional[str] = None) -> Optional[Dict]:
+        # The comments table is the log here: ids only grow and rows are never updated
+        created_at = time.time()
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO comments (image_id, body, author, created_at) SELECT id, ?, ?, ? FROM images WHERE id = ?",
+                (comment, author, created_at, image_id)
+            )
+        if not cur.rowcount:
+            return None
+        return {"id": cur.lastrowid, "body": comment, "author": author, "created_at": created_at}
+
+    def get_comments(self, image_id: int, before: Optional[int] = None, limit: int = COMMENTS_PAGE_SIZE) -> Optional[List[Dict]]:
+        # Keyset page: a backwards range scan of the (image_id, id) index, no OFFSET
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM images WHERE id = ?", (image_id,)).fetchone() is None:
+                return None
+            rows = self.conn.execute(
+                "SELECT id, body, author, created_at FROM comments WHERE image_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (image_id, before if before is not None else 1 << 62, limit)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def comments_after(self, comment_id: int, limit: int = COMMENT_SYNC_BATCH) -> List[tuple]:
+        # A range scan of the primary key; ids only grow, so nothing committed later sorts earlier
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT image_id, id, body, author, created_at FROM comments WHERE id > ? ORDER BY id LIMIT ?", (comment_id, limit)
+            ).fetchall()
+        return [(r[0], {"id": r[1], "body": r[2], "author": r[3], "created_at": r[4]}) for r in rows]
+
+    def get_user(self, username: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT id, email, password FROM users WHERE username = ?", (username,)).fetchone()
+        return dict(row) if row else None
+
+    def get_username(self, user_id: int) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT username FROM users WHERE id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, username: str, email: str, password: str) -> Optional[int]:
+        with self.lock:
+            try:
+                cur = self.conn.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)", (username, email, password))
+            except sqlite3.IntegrityError:
+                return None
+        return cur.lastrowid
+
+    def add_blob_ref(self, digest: str, size: int) -> int:
+        with self.lock:
+            row = self.conn.execute(
+                "INSERT INTO blobs (digest, size, refcount) VALUES (?, ?, 1) "
+                "ON CONFLICT(digest) DO UPDATE SET refcount = refcount + 1 RETURNING refcount",
+                (digest, size)
+            ).fetchone()
+        return row[0]
+
+    def release_blob(self, digest: str) -> int:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE digest = ? RETURNING refcount", (digest,)).fetchone()
+                remaining = max(row[0], 0) if row else 0
+                if row and remaining == 0:
+                    self.conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return remaining
+
+    def blob_stats(self) -> Dict:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(refcount), 0), COALESCE(SUM(size), 0), COALESCE(SUM(size * refcount), 0) FROM blobs"
+            ).fetchone()
+        return {"blobs": row[0], "references": row[1], "physical_bytes": row[2], "logical_bytes": row[3]}
+
+
+def create_repository(backend: str = STORAGE_BACKEND) -> Repository:
+    """Build the storage backend selected at startup"""
+    if backend == "memory":
+        repo = InMemoryRepository()
+    elif backend == "sqlite":
+        repo = SQLiteRepository(SQLITE_PATH)
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    repo.seed()
+    return repo
+
+
+class FeedIndex:
+    """Image ids kept in ascending order so feed pages are slices instead of sorts.
+    Ids are assigned in increasing order, so an upload is an append."""
+
+    def __init__(self):
+        self.ids = array("q")
+        # Every id up to here has been seen in the store. This worker's own uploads are
+        # added directly and don't move it: another worker may have committed a lower id
+        # that catch_up has not fetched yet.
+        self.synced = 0
+
+    def rebuild(self, image_ids: List[int]):
+        self.ids = array("q", sorted(image_ids))
+        self.synced = self.ids[-1] if self.ids else 0
+
+    def add(self, image_id: int) -> bool:
+        """Insert an id, return False if it was already present"""
+        if not self.ids or image_id > self.ids[-1]:
+            self.ids.append(image_id)
+            return True
+        # Out-of-order insert (e.g. a concurrent worker's upload), keep sorted
+        pos = bisect_left(self.ids, image_id)
+        if pos < len(self.ids) and self.ids[pos] == image_id:
+            return False
+        self.ids.insert(pos, image_id)
+        return True
+
+    def remove(self, image_id: int):
+        pos = bisect_left(self.ids, image_id)
+        if pos < len(self.ids) and self.ids[pos] == image_id:
+            del self.ids[pos]
+
+    async def catch_up(self, repo: Repository) -> List[int]:
+        """Pick up images added by other workers since the last catch-up, return their ids"""
+        found = await repo.run(repo.image_ids_after, self.synced)
+        if found:
+            self.synced = max(self.synced, found[-1])
+        return [image_id for image_id in found if self.add(image_id)]
+
+    def page(self, cursor: Optional[int], limit: int) -> List[int]:
+        """Up to limit ids below cursor (or the newest if None), newest first"""
+        end = len(self.ids) if cursor is None else bisect_left(self.ids, cursor)
+        return self.ids[max(end - limit, 0):end].tolist()[::-1]
+
+
+store = create_repository()
+# Position in the deletion log, read before the indexes are built so deletes racing the build get replayed
+deletions_synced = max((seq for seq, _ in store.deletions_after(0)), default=0)
+feed_index = FeedIndex()
+feed_index.rebuild(store.image_ids()) # Only full scan, done once at startup
+
+# --- Static Assets ---
+
+STATIC_DIR = os.environ.get("STATIC_DIR", "static")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+# Basic CSS for layout, published as a content-hashed file by publish_css()
+APP_CSS = """
+body { font-family: sans-serif; margin: 0; padding: 20px; background-color: #f4f4f4; }
+.container { max-width: 900px; margin: auto; background: white; padding: 20px; box-shadow: 0 0 10px rgba(0,0,0,0.1); }
+.header { display: flex; justify-content: space-between; align-items: center; padding-bottom: 15px; border-bottom: 1px solid #ccc; margin-bottom: 20px; }
+.header form { flex-grow: 1; display: flex; }
+.header input[type='search'] { flex-grow: 1; margin: 0 15px; padding: 8px; }
+.header button, .header a { padding: 8px 12px; text-decoration: none; background-color: #eee; border: 1px solid #ccc; border-radius: 4px; cursor: pointer; }
+.header a { display: inline-block; }
+.image-grid { display: grid; grid-template-columns: repeat(auto-fill, minmax(200px, 1fr)); gap: 15px; margin-bottom: 20px; }
+.image-grid-item img { max-width: 100%; height: auto; display: block; border: 1px solid #ddd; }
+picture { display: contents; }
+.feed-sentinel { grid-column: 1 / -1; height: 1px; }
+.no-results { grid-column: 1 / -1; color: #666; }
+.image-detail { display: flex; gap: 20px; }
+.image-detail img { max-width: 60%; height: auto; object-fit: contain; border: 1px solid #ddd; }
+.image-info { flex-grow: 1; }
+.actions button { margin-right: 10px; padding: 5px 10px; }
+.liked-badge { margin: 0 10px; color: #e60023; font-weight: bold; }
+.liked-badge:empty { display: none; }
+.liked-badge:empty ~ .unlike-button, .liked-badge:not(:empty) ~ .like-button { display: none; }
+.comments-section { margin-top: 20px; }
+.similar-strip { margin-top: 30px; border-top: 1px solid #ccc; }
+.near-duplicates { color: #a60; }
+.near-duplicates a { margin-left: 5px; }
+.comments-list { list-style: none; padding: 0; margin-bottom: 15px; }
+.comments-list li { padding: 8px; border-bottom: 1px solid #eee; }
+.comments-list .no-comments:not(:only-child) { display: none; }
+.comments-list .comments-more { border-bottom: none; }
+.comment-time { margin-left: 8px; color: #888; }
+.comment-form input { width: calc(100% - 80px); padding: 8px; }
+.comment-form button { padding: 8px 15px; }
+.modal { position: fixed; top: 0; left: 0; width: 100%; height: 100%; background-color: rgba(0,0,0,0.5); display: flex; justify-content: center; align-items: center; z-index: 1000;}
+.modal-content { background: white; padding: 30px; border-radius: 5px; min-width: 300px; max-width: 500px; }
+.hidden { display: none; }
+"""
+
+def write_atomic(path: str, data: bytes):
+    """Write via a temp file and rename, so concurrent workers never serve a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def publish_css() -> str:
+    """Write APP_CSS to STATIC_DIR under a content hash, with .gz/.br variants, and return its URL"""
+    data = APP_CSS.encode()
+    filename = f"app.{hashlib.sha256(data).hexdigest()[:12]}.css"
+    path = os.path.join(STATIC_DIR, filename)
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    if not os.path.exists(path):
+        write_atomic(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            write_atomic(path + ".br", brotli.compress(data, quality=11))
+        write_atomic(path, data) # Written last: its presence means the variants exist
+    return f"/static/{filename}"
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """Serves fingerprinted files with an immutable Cache-Control, using the precompressed
+    .br / .gz variant when the client accepts it"""
+
+    ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+    async def get_response(self, path: str, scope):
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        response = None
+        for encoding, suffix in self.ENCODINGS:
+            if encoding not in accept_encoding:
+                continue
+            try:
+                response = await super().get_response(path + suffix, scope)
+            except StarletteHTTPException:
+                continue # No variant for this encoding
+            response.headers["Content-Encoding"] = encoding
+            response.headers["Content-Type"] = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            break
+        if response is None:
+            response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+CSS_URL = publish_css()
+app.mount("/static", PrecompressedStaticFiles(directory=STATIC_DIR), name="static")
+
+# --- Object Store ---
+
+OBJECT_STORE_DIR = os.environ.get("OBJECT_STORE_DIR", "objects")
+UPLOAD_CHUNK_SIZE = 1024 * 1024 # Bytes held in memory per upload at any time
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024
+
+# Leading bytes of the image formats we accept, mapped to the extension used in URLs
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+]
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Extension for the image format in the first bytes of a file, or None"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    return None
+
+
+class ObjectTooLarge(Exception):
+    pass
+
+
+class ObjectStore:
+    """Content-addressed blobs on local disk, sharded as <root>/ab/cd/<sha256>.
+    Identical uploads share one blob; reference counts live in the repository."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.lock_path = os.path.join(root, ".lock")
+        self.thread_lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        """Serialize reference-count changes with the file create/unlink they imply, across workers"""
+        with self.thread_lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path_for(digest))
+
+    async def put_stream(self, upload: UploadFile, refs: Repository, max_bytes: int = MAX_UPLOAD_BYTES):
+        """Stream an upload to disk chunk by chunk while hashing it, then either keep it as a new
+        blob or drop it in favour of the existing copy; return (digest, size, deduplicated)"""
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                def write_chunk(chunk: bytes):
+                    sha.update(chunk)
+                    f.write(chunk)
+
+                while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ObjectTooLarge(f"Upload exceeds {max_bytes} bytes")
+                    # Hashing and disk writes run off the event loop
+                    await run_in_threadpool(write_chunk, chunk)
+            digest = sha.hexdigest()
+            deduplicated = await run_in_threadpool(self.commit, tmp_path, digest, size, refs)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return digest, size, deduplicated
+
+    def commit(self, tmp_path: str, digest: str, size: int, refs: Repository) -> bool:
+        """Move a fully written temp file into place as a blob, or drop it if the blob
+        already exists; either way the blob gains a reference. Returns True if deduplicated."""
+        path = self.path_for(digest)
+        with self.locked():
+            refs.add_blob_ref(digest, size)
+            deduplicated = os.path.exists(path)
+            if deduplicated:
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path) # Atomic: readers never see a partial blob
+        return deduplicated
+
+    def retain(self, digest: str, refs: Repository) -> bool:
+        """Add a reference to a blob that is already stored, return False if it is gone"""
+        path = self.path_for(digest)
+        with self.locked():
+            if not os.path.exists(path):
+                return False
+            refs.add_blob_ref(digest, os.path.getsize(path))
+        return True
+
+    def release(self, digest: str, refs: Repository):
+        """Drop one reference and delete the blob once nothing points at it"""
+        with self.locked():
+            if refs.release_blob(digest) == 0:
+                try:
+                    os.unlink(self.path_for(digest))
+                except FileNotFoundError:
+                    pass
+
+
+object_store = ObjectStore(OBJECT_STORE_DIR)
+
+def object_url(digest: str, ext: str) -> str:
+    return f"/objects/{digest}{ext}"
+
+def digest_from_url(url: str) -> str:
+    return os.path.splitext(os.path.basename(url))[0]
+
+# --- Image Variants ---
+
+# Every width is generated in every format; variants are named "<format>-<width>"
+VARIANT_WIDTHS = (236, 474, 736, 1200)
+VARIANT_FORMATS = {"jpg": ("JPEG", ".jpg"), "webp": ("WEBP", ".webp")}
+VARIANT_WORKERS = int(os.environ.get("VARIANT_WORKERS", "2"))
+
+variant_pool: Optional[ProcessPoolExecutor] = None
+variant_tasks = set() # Strong references so pending tasks are not garbage collected
+
+def hash_file(path: str):
+    """SHA-256 and size of a file, read in chunks"""
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+def read_dimensions(path: str):
+    """Display (width, height) of an image from its header, without decoding the pixels"""
+    if PILImage is None:
+        return None, None
+    try:
+        with PILImage.open(path) as im:
+            width, height = im.size
+            if im.getexif().get(0x0112) in (5, 6, 7, 8): # EXIF orientation rotated by 90 degrees
+                width, height = height, width
+    except Exception:
+        return None, None
+    return width, height
+
+def make_variants(original, tmp_dir: str) -> List[tuple]:
+    """Write each resized variant of a decoded image to a temp file.
+    Returns (name, tmp_path, digest, size, ext) tuples."""
+    results = []
+    # Never upscale: widths beyond the original collapse into one full-width variant
+    widths = sorted({min(width, original.width) for width in VARIANT_WIDTHS})
+    for width in widths:
+        resized = original.copy()
+        resized.thumbnail((width, width * 10)) # Bounded by width, keeps aspect ratio
+        for fmt_name, (fmt, ext) in VARIANT_FORMATS.items():
+            variant = resized
+            if fmt == "JPEG" and variant.mode not in ("RGB", "L"):
+                variant = variant.convert("RGB")
+            fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+            with os.fdopen(fd, "wb") as f:
+                variant.save(f, fmt, quality=82)
+            digest, size = hash_file(tmp_path)
+            results.append((f"{fmt_name}-{resized.width}", tmp_path, digest, size, ext))
+    return results
+
+def analyze_image(src_path: str, tmp_dir: str) -> Dict:
+    """Runs in a worker process: decode the original once, then derive the size
+    variants, the similarity feature vector and the perceptual hash from it"""
+    with PILImage.open(src_path) as original:
+        original = ImageOps.exif_transpose(original) # Apply camera rotation first
+        return {
+            "variants": make_variants(original, tmp_dir),
+            "features": image_features(original).tobytes() if np is not None else None,
+            "phash": dhash(original),
+        }
+
+async def analyze_upload(image_id: int, digest: str):
+    """Process an uploaded original on the process pool and attach the results to the image"""
+    global variant_pool
+    if variant_pool is None:
+        variant_pool = ProcessPoolExecutor(max_workers=VARIANT_WORKERS)
+    loop = asyncio.get_running_loop()
+    try:
+        analysis = await loop.run_in_executor(variant_pool, analyze_image, object_store.path_for(digest), object_store.tmp_dir)
+    except Exception as e:
+        print(f"Image analysis failed for image {image_id}: {e}")
+        return
+    variants = {}
+    try:
+        for name, tmp_path, variant_digest, size, ext in analysis["variants"]:
+            await run_in_threadpool(object_store.commit, tmp_path, variant_digest, size, store)
+            variants[name] = object_url(variant_digest, ext)
+    except Exception as e:
+        print(f"Storing variants failed for image {image_id}: {e}")
+        for url in variants.values(): # Committed blobs hold a reference nothing else will drop
+            await run_in_threadpool(object_store.release, digest_from_url(url), store)
+        for _, tmp_path, *_ in analysis["variants"]:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return
+    await attach_analysis(image_id, variants, analysis["features"], analysis["phash"])
+
+async def reuse_analysis(image_id: int, digest: str) -> bool:
+    """Give a deduplicated upload the variants, features and hash of an earlier image with the
+    same blob instead of decoding it again; False if no such image has finished analysis"""
+    source = await store.run(store.image_with_variants, digest)
+    if source is None:
+        return False
+    variants = {}
+    for name, url in source['variants'].items():
+        if not await run_in_threadpool(object_store.retain, digest_from_url(url), store): # Source deleted meanwhile
+            for kept in variants.values():
+                await run_in_threadpool(object_store.release, digest_from_url(kept), store)
+            return False
+        variants[name] = url
+    features = await store.run(store.get_features, source['id'])
+    phash = await store.run(store.get_phash, source['id'])
+    await attach_analysis(image_id, variants, features, phash)
+    return True
+
+async def attach_analysis(image_id: int, variants: Dict[str, str], features: Optional[bytes], phash: Optional[int]):
+    """Record an image's variants, feature vector and hash, and add them to the in-process indexes"""
+    if not await store.run(store.set_variants, image_id, variants): # Deleted while we were processing
+        for url in variants.values():
+            await run_in_threadpool(object_store.release, digest_from_url(url), store)
+        return
+    page_cache.invalidate() # Other workers notice the feed version move
+    if features is not None and await store.run(store.set_features, image_id, features) and vector_index is not None:
+        vector_index.add(image_id, np.frombuffer(features, dtype=np.float32))
+        vector_index.train_in_background() # k-means on a worker thread once the index has grown enough
+    if phash is not None and await store.run(store.set_phash, image_id, phash):
+        duplicates = phash_index.near(phash)
+        phash_index.add(image_id, phash)
+        if duplicates:
+            print(f"Image {image_id} looks like a near-duplicate of {[dup_id for dup_id, _ in duplicates]}")
+
+def schedule_analysis(image_id: int, digest: str):
+    if PILImage is None:
+        return # Pillow not installed: pages keep using the original
+    task = asyncio.create_task(analyze_upload(image_id, digest))
+    variant_tasks.add(task)
+    task.add_done_callback(variant_tasks.discard)
+
+@app.on_event("shutdown")
+async def shutdown_variant_pool():
+    if variant_pool is not None:
+        variant_pool.shutdown(wait=False, cancel_futures=True)
+
+# --- Search ---
+
+SEARCH_RESULTS = 30
+QUERY_SUGGESTIONS = 10000 # Searches remembered for autocomplete, least recently searched dropped first
+QUERY_SUGGESTION_LENGTH = 64 # Longer queries are not remembered
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """In-process inverted index over image descriptions and comments, ranked with BM25.
+    Postings map term -> {image_id: term frequency} and are updated incrementally; the
+    terms of each image are kept too, so an image can be dropped by id alone."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_lengths: Dict[int, int] = {} # image_id: number of indexed tokens
+        self.doc_terms: Dict[int, List[str]] = {} # image_id: distinct indexed terms
+        self.total_length = 0
+        self.prefixes: Optional[PrefixIndex] = None # Kept in step with document frequencies once attached
+
+    def add_text(self, image_id: int, text: str):
+        """Index more text for an image: its description, or a new comment"""
+        tokens = tokenize(text)
+        for term in tokens:
+            docs = self.postings.setdefault(term, {})
+            tf = docs.get(image_id, 0)
+            docs[image_id] = tf + 1
+            if tf == 0:
+                self.doc_terms.setdefault(image_id, []).append(term)
+                if self.prefixes is not None:
+                    self.prefixes.set_weight(term, len(docs))
+        self.doc_lengths[image_id] = self.doc_lengths.get(image_id, 0) + len(tokens)
+        self.total_length += len(tokens)
+
+    def remove_image(self, image_id: int):
+        """Drop an image's postings"""
+        for term in self.doc_terms.pop(image_id, ()):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(image_id, None)
+                if not docs:
+                    del self.postings[term]
+                if self.prefixes is not None:
+                    self.prefixes.set_weight(term, len(docs))
+        self.total_length -= self.doc_lengths.pop(image_id, 0)
+
+    def search(self, query: str, limit: int = SEARCH_RESULTS) -> List[int]:
+        """Best matching image ids, touching only the postings of the query terms"""
+        doc_count = len(self.doc_lengths)
+        if not doc_count:
+            return []
+        avg_length = self.total_length / doc_count or 1
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for image_id, tf in docs.items():
+                norm = self.K1 * (1 - self.B + self.B * self.doc_lengths[image_id] / avg_length)
+                scores[image_id] = scores.get(image_id, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+        # Ties go to the newest image
+        return heapq.nlargest(limit, scores, key=lambda image_id: (scores[image_id], image_id))
+
+
+class TrieNode:
+    __slots__ = ("children", "weight", "best", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "TrieNode"] = {}
+        self.weight = 0 # Weight of the term ending here, 0 if none does
+        self.best = 0 # Heaviest weight anywhere in this subtree
+        self.top: Optional[List[str]] = None # Cached top-k completions, cleared when a term below changes
+
+
+class PrefixIndex:
+    """Autocomplete over a trie whose nodes record the heaviest weight below them. The
+    top-k completions of a prefix come from a best-first walk that only opens subtrees
+    that can still beat the k-th result, so ranking is exact at every prefix length
+    without scanning all the matching terms. With max_terms set, the least recently
+    weighted terms are dropped once there are more than that. A prefix's results are
+    cached on its node until a term below it changes."""
+
+    TOP_K = 8
+
+    def __init__(self, max_terms: Optional[int] = None):
+        self.max_terms = max_terms
+        self.weights: Dict[str, int] = OrderedDict() # term: weight, least recently set first
+        self.root = TrieNode()
+
+    def rebuild(self, weights: Dict[str, int]):
+        self.weights = OrderedDict()
+        self.root = TrieNode()
+        for term, weight in weights.items():
+            self.set_weight(term, weight)
+
+    def path_to(self, term: str, create: bool = False) -> List[TrieNode]:
+        path = [self.root]
+        for char in term:
+            node = path[-1].children.get(char)
+            if node is None:
+                if not create:
+                    return []
+                node = path[-1].children[char] = TrieNode()
+            path.append(node)
+        return path
+
+    def set_weight(self, term: str, weight: int):
+        """Add, re-weight or (at weight 0) remove a term"""
+        if weight <= 0:
+            self.remove(term)
+            return
+        path = self.path_to(term, create=True)
+        path[-1].weight = weight
+        self.weights[term] = weight
+        self.weights.move_to_end(term)
+        self.update(term, path)
+        if self.max_terms is not None and len(self.weights) > self.max_terms:
+            self.remove(next(iter(self.weights)))
+
+    def remove(self, term: str):
+        if self.weights.pop(term, None) is None:
+            return
+        path = self.path_to(term)
+        path[-1].weight = 0
+        self.update(term, path)
+
+    @staticmethod
+    def update(term: str, path: List[TrieNode]):
+        """Recompute the subtree maxima along a root-to-term path, bottom up, stopping at the
+        first node whose maximum did not change; subtrees left without terms are unlinked"""
+        for node in path:
+            node.top = None
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            best = max(node.weight, max((child.best for child in node.children.values()), default=0))
+            if best == node.best:
+                break
+            node.best = best
+            if not best and depth:
+                del path[depth - 1].children[term[depth - 1]]
+
+    def suggest(self, prefix: str, k: int = TOP_K) -> List[str]:
+        path = self.path_to(prefix) if prefix else []
+        if not path:
+            return []
+        start = path[-1]
+        if k <= self.TOP_K:
+            if start.top is None:
+                start.top = self.walk(prefix, start, self.TOP_K)
+            return start.top[:k]
+        return self.walk(prefix, start, k)
+
+    @staticmethod
+    def walk(prefix: str, start: TrieNode, k: int) -> List[str]:
+        """Best-first search below start for the k heaviest terms, ties in alphabetical order"""
+        # Heap entries are (-weight, text, kind, node); kind 0 is a term, kind 1 a subtree to open
+        heap = [(-start.best, prefix, 1, start)]
+        suggestions = []
+        while heap and len(suggestions) < k:
+            _, text, kind, node = heapq.heappop(heap)
+            if kind == 0:
+                suggestions.append(text)
+                continue
+            if node.weight:
+                heapq.heappush(heap, (-node.weight, text, 0, None))
+            for char, child in node.children.items():
+                heapq.heappush(heap, (-child.best, text + char, 1, child))
+        return suggestions
+
+
+search_index = SearchIndex()
+for img_data in store.iter_images(with_comments=False):
+    if img_data['id'] <= feed_index.synced: # Anything newer is picked up by sync_indexes
+        search_index.add_text(img_data['id'], img_data['description'])
+
+# Comments are caught up by id, whichever worker posted them
+comments_synced = -1 # Every comment up to this id is indexed
+
+# Autocomplete sources: indexed terms weighted by how many images use them, and
+# queries weighted by how often they were searched with results
+term_suggestions = PrefixIndex()
+term_suggestions.rebuild({term: len(docs) for term, docs in search_index.postings.items()})
+search_index.prefixes = term_suggestions
+query_suggestions = PrefixIndex(max_terms=QUERY_SUGGESTIONS)
+
+def suggest(q: str, k: int = PrefixIndex.TOP_K) -> List[str]:
+    """Popular queries starting with q, then completions of its last word"""
+    tokens = tokenize(q)
+    if not tokens:
+        return []
+    suggestions = query_suggestions.suggest(" ".join(tokens), k)
+    if q[-1:].isalnum(): # Still typing the last word
+        lead = " ".join(tokens[:-1] + [""])
+        suggestions += [lead + term for term in term_suggestions.suggest(tokens[-1], k)]
+    return list(dict.fromkeys(suggestions))[:k]
+
+def index_comments(batch: List[tuple]) -> List[tuple]:
+    """Index a catch-up batch, return the (image_id, comment) pairs that were new"""
+    global comments_synced
+    indexed = []
+    for image_id, comment in batch:
+        if comment["id"] > comments_synced: # A concurrent catch-up may have got here first
+            search_index.add_text(image_id, comment["body"])
+            comments_synced = comment["id"]
+            indexed.append((image_id, comment))
+    return indexed
+
+while batch := store.comments_after(comments_synced):
+    index_comments(batch)
+
+async def sync_comments():
+    """Index comments posted since the last call, through this worker or any other, and
+    push the ones posted elsewhere to this worker's live viewers"""
+    while True:
+        batch = await store.run(store.comments_after, comments_synced)
+        for image_id, comment in index_comments(batch):
+            live_updates.publish_synced_comment(image_id, comment)
+        if len(batch) < COMMENT_SYNC_BATCH:
+            break
+    live_updates.forget_published(comments_synced)
+
+def forget_image(image_id: int):
+    """Drop a deleted image from this worker's in-process indexes"""
+    feed_index.remove(image_id)
+    search_index.remove_image(image_id)
+    phash_index.remove(image_id)
+    awaiting_analysis.pop(image_id, None)
+    like_buffer.forget(image_id)
+    if vector_index is not None:
+        vector_index.remove(image_id)
+
+synced_at = 0.0 # When sync_indexes last looked at the store
+synced_version = None # Feed version the indexes were last caught up to
+
+async def sync_indexes(force: bool = False):
+    """Bring this worker's in-process indexes up to date with images uploaded and deleted
+    through other workers, and drop cached pages if any worker changed the feed. Only one
+    feed version read per SYNC_INTERVAL unless forced; the rest runs when it moved."""
+    global synced_at, synced_version, deletions_synced
+    now = time.monotonic()
+    if not force and now - synced_at < SYNC_INTERVAL:
+        return
+    synced_at = now
+    version = await store.run(store.feed_version)
+    if version == synced_version:
+        return
+    new_ids = await feed_index.catch_up(store)
+    for img_data in await store.run(store.get_images, new_ids):
+        search_index.add_text(img_data['id'], img_data['description'])
+        awaiting_analysis.setdefault(img_data['id'], now)
+    for seq, image_id in await store.run(store.deletions_after, deletions_synced):
+        if seq > deletions_synced:
+            forget_image(image_id)
+            deletions_synced = seq
+    # Cleared after the catch-up, so pages rendered meanwhile from the old indexes are dropped too
+    page_cache.sync(version)
+    synced_version = version
+
+# --- Visual Similarity ---
+
+SIMILAR_COUNT = 8
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", "vector_index")
+COLOR_LEVELS = 4 # Per channel, so the colour histogram has 4 ** 3 = 64 bins
+THUMB_SIZE = 8 # Downscaled grayscale layout, 8 x 8 = 64 values
+FEATURE_DIM = COLOR_LEVELS ** 3 + THUMB_SIZE ** 2
+
+def image_features(img) -> "np.ndarray":
+    """CPU-only feature vector: colour histogram plus a downscaled grayscale layout, unit length"""
+    pixels = np.asarray(img.convert("RGB").resize((64, 64)), dtype=np.float32) / 256
+    levels = (pixels * COLOR_LEVELS).astype(np.int64)
+    bins = (levels[..., 0] * COLOR_LEVELS + levels[..., 1]) * COLOR_LEVELS + levels[..., 2]
+    histogram = np.bincount(bins.ravel(), minlength=COLOR_LEVELS ** 3).astype(np.float32)
+    histogram /= np.linalg.norm(histogram) or 1
+    layout = np.asarray(img.convert("L").resize((THUMB_SIZE, THUMB_SIZE)), dtype=np.float32).ravel()
+    layout -= layout.mean()
+    layout /= np.linalg.norm(layout) or 1
+    vector = np.concatenate([histogram, layout])
+    return vector / (np.linalg.norm(vector) or 1)
+
+
+class VectorIndex:
+    """Unit-length float32 feature vectors in one contiguous matrix, so cosine
+    similarity for a batch of queries is a single matrix product"""
+
+    def __init__(self, dim: int = FEATURE_DIM, capacity: int = 1024):
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.rows: Dict[int, int] = {} # image_id: row in matrix
+        self.count = 0
+
+    def add(self, image_id: int, vector: "np.ndarray"):
+        row = self.rows.get(image_id)
+        if row is None:
+            if self.count == len(self.matrix): # Grow by doubling, amortised O(1) appends
+                self.grow(2 * len(self.matrix))
+            row = self.count
+            self.count += 1
+            self.rows[image_id] = row
+            self.ids[row] = image_id
+        self.matrix[row] = vector
+
+    def grow(self, capacity: int):
+        self.matrix = np.concatenate([self.matrix, np.zeros((capacity - len(self.matrix), self.matrix.shape[1]), dtype=np.float32)])
+        self.ids = np.concatenate([self.ids, np.zeros(capacity - len(self.ids), dtype=np.int64)])
+
+    def remove(self, image_id: int):
+        """Move the last row into the freed slot to keep the matrix dense"""
+        row = self.rows.pop(image_id, None)
+        if row is None:
+            return
+        last = self.count - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.ids[row] = self.ids[last]
+            self.rows[int(self.ids[row])] = row
+        self.count = last
+
+    def search(self, queries: "np.ndarray", k: int) -> List[List[tuple]]:
+        """Top-k (image_id, score) per query row, by cosine similarity"""
+        if self.count == 0:
+            return [[] for _ in range(len(queries))]
+        scores = queries @ self.matrix[:self.count].T # (queries, count)
+        k = min(k, self.count)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query_scores, candidates in zip(scores, top):
+            ranked = candidates[np.argsort(-query_scores[candidates])]
+            results.append([(int(self.ids[i]), float(query_scores[i])) for i in ranked])
+        return results
+
+    def similar(self, image_id: int, k: int = SIMILAR_COUNT) -> List[int]:
+        """Ids of the k images most similar to image_id, excluding itself"""
+        row = self.rows.get(image_id)
+        if row is None:
+            return []
+        matches = self.search(self.matrix[row:row + 1], k + 1)[0]
+        return [match_id for match_id, _ in matches if match_id != image_id][:k]
+
+
+class IVFIndex(VectorIndex):
+    """Approximate nearest neighbours with an inverted file: vectors are assigned to
+    their nearest k-means centroid and a query only scores the vectors in its
+    nprobe closest lists. Until enough vectors exist to train, search is exact.
+
+    Vectors, ids and list assignments live in memory-mapped files under path, so
+    the index survives restarts without recomputing anything. Retraining as the index
+    grows runs on a worker thread while searches keep using the current lists."""
+
+    TRAIN_AT = 20000 # Vectors needed before clustering is worthwhile
+    RETRAIN_GROWTH = 4 # Retrain once the index has grown this much since the last training
+    SAMPLE_SIZE = 50000
+    NPROBE = 8
+
+    def __init__(self, path: str, dim: int = FEATURE_DIM, capacity: int = 1024):
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        meta = json.load(open(meta_path)) if os.path.exists(meta_path) else {}
+        if meta.get("dim", dim) != dim: # Feature layout changed, start over
+            meta = {}
+        capacity = meta.get("capacity", capacity)
+        self.matrix = self.open_array("vectors.f32", np.float32, (capacity, dim), bool(meta))
+        self.ids = self.open_array("ids.i64", np.int64, (capacity,), bool(meta))
+        self.assignments = self.open_array("lists.i32", np.int32, (capacity,), bool(meta))
+        self.count = meta.get("count", 0)
+        self.trained_at = meta.get("trained_at", 0)
+        self.rows = {int(image_id): row for row, image_id in enumerate(self.ids[:self.count])}
+        centroids_path = os.path.join(path, "centroids.npy")
+        self.centroids = np.load(centroids_path) if meta and os.path.exists(centroids_path) else None
+        self.training: Optional[asyncio.Task] = None
+        self.dirty: Optional[set] = None # Rows changed while a background training runs
+        self.build_lists()
+
+    def open_array(self, name: str, dtype, shape: tuple, existing: bool):
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r+" if existing else "w+", shape=shape)
+
+    def save_meta(self):
+        meta = {"dim": self.dim, "capacity": len(self.matrix), "count": self.count, "trained_at": self.trained_at}
+        write_atomic(os.path.join(self.path, "meta.json"), json.dumps(meta).encode())
+
+    def grow(self, capacity: int):
+        # Memory maps cannot be resized in place: flush, extend the files, map them again
+        for array_name, name, dtype, shape in (
+            ("matrix", "vectors.f32", np.float32, (capacity, self.dim)),
+            ("ids", "ids.i64", np.int64, (capacity,)),
+            ("assignments", "lists.i32", np.int32, (capacity,)),
+        ):
+            getattr(self, array_name).flush()
+            setattr(self, array_name, np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r+", shape=shape))
+        self.save_meta()
+
+    def build_lists(self):
+        """Posting lists (rows per centroid) from the persisted assignments"""
+        if self.centroids is None:
+            self.lists = []
+            return
+        assignments = np.asarray(self.assignments[:self.count])
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        self.lists = [array("q", order[bounds[c]:bounds[c + 1]].tolist()) for c in range(len(self.centroids))]
+
+    def nearest_centroids(self, vectors: "np.ndarray") -> "np.ndarray":
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def fit(self, vectors: "np.ndarray") -> tuple:
+        """Spherical k-means over a sample, then every vector's nearest centroid.
+        Only reads its argument, so it can run off the event loop."""
+        count = len(vectors)
+        list_count = int(min(4096, max(16, 4 * math.sqrt(count))))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(vectors[rng.choice(count, min(count, self.SAMPLE_SIZE), replace=False)])
+        centroids = kmeans(sample, list_count)
+        assignments = np.empty(count, dtype=np.int32)
+        for start in range(0, count, 65536): # Chunked to bound the score matrix
+            stop = min(start + 65536, count)
+            assignments[start:stop] = np.argmax(vectors[start:stop] @ centroids.T, axis=1)
+        return centroids, assignments
+
+    def install(self, centroids: "np.ndarray", assignments: "np.ndarray", dirty=()):
+        """Switch to newly trained centroids. Rows added or moved since the vectors were
+        read (dirty, or past the end of assignments) are assigned again here."""
+        self.centroids = centroids
+        trained = min(len(assignments), self.count)
+        self.assignments[:trained] = assignments[:trained]
+        stale = sorted({row for row in dirty if row < self.count} | set(range(trained, self.count)))
+        if stale:
+            self.assignments[stale] = self.nearest_centroids(self.matrix[stale])
+        centroids_file = io.BytesIO()
+        np.save(centroids_file, self.centroids)
+        write_atomic(os.path.join(self.path, "centroids.npy"), centroids_file.getvalue()) # Readers may load it any time
+        self.trained_at = len(assignments)
+        self.build_lists()
+        self.save_meta()
+
+    def train(self):
+        self.install(*self.fit(self.matrix[:self.count]))
+
+    def train_in_background(self):
+        """Start retraining on a worker thread if it is due and not already running"""
+        if self.training is None and self.training_due():
+            self.training = asyncio.create_task(self.retrain())
+
+    async def retrain(self):
+        self.dirty = set()
+        try:
+            centroids, assignments = await run_in_threadpool(self.fit, self.matrix[:self.count])
+            self.install(centroids, assignments, self.dirty)
+        except Exception as e:
+            print(f"Vector index training failed: {e}")
+        finally:
+            self.dirty = None
+            self.training = None
+
+    def insert(self, image_id: int, vector: "np.ndarray"):
+        if image_id in self.rows and self.centroids is not None:
+            self.unlist(self.rows[image_id])
+        super().add(image_id, vector)
+        row = self.rows[image_id]
+        if self.dirty is not None:
+            self.dirty.add(row)
+        if self.centroids is not None:
+            self.assignments[row] = self.nearest_centroids(self.matrix[row:row + 1])[0]
+            self.lists[self.assignments[row]].append(row)
+
+    def add(self, image_id: int, vector: "np.ndarray"):
+        """Insert one vector; the caller starts train_in_background() once it is due"""
+        self.insert(image_id, vector)
+        self.save_meta()
+
+    def bulk_load(self, items: Iterator[tuple]):
+        """Insert many (image_id, vector) pairs, saving and training once at the end"""
+        for image_id, vector in items:
+            self.insert(image_id, vector)
+        self.save_meta()
+        self.maybe_train()
+
+    def reconcile(self, items: Iterator[tuple]):
+        """Make the index hold exactly the given (image_id, vector) pairs, the store's:
+        vectors other workers wrote while this index was not theirs are added, and ids
+        the store no longer has (or has reused for another picture) are dropped or replaced"""
+        seen = set()
+        for image_id, vector in items:
+            seen.add(image_id)
+            row = self.rows.get(image_id)
+            if row is None or not np.array_equal(self.matrix[row], vector):
+                self.insert(image_id, vector)
+        for image_id in [image_id for image_id in self.rows if image_id not in seen]:
+            self.drop(image_id)
+        self.save_meta()
+        self.maybe_train()
+
+    def training_due(self) -> bool:
+        return self.count >= max(self.TRAIN_AT, self.RETRAIN_GROWTH * self.trained_at)
+
+    def maybe_train(self):
+        if self.training_due():
+            self.train()
+
+    def unlist(self, row: int):
+        rows = self.lists[self.assignments[row]]
+        del rows[rows.index(row)]
+
+    def drop(self, image_id: int):
+        row = self.rows.get(image_id)
+        if row is None:
+            return
+        last = self.count - 1
+        if self.centroids is not None:
+            self.unlist(row)
+            if row != last: # The last row moves into the freed slot
+                rows = self.lists[self.assignments[last]]
+                rows[rows.index(last)] = row
+                self.assignments[row] = self.assignments[last]
+        if self.dirty is not None:
+            self.dirty.add(row)
+        super().remove(image_id)
+
+    def remove(self, image_id: int):
+        self.drop(image_id)
+        self.save_meta()
+
+    def search(self, queries: "np.ndarray", k: int, nprobe: int = NPROBE) -> List[List[tuple]]:
+        if self.centroids is None:
+            return super().search(queries, k)
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for query, lists in zip(queries, probes):
+            candidates = np.concatenate([np.frombuffer(self.lists[c], dtype=np.int64) for c in lists])
+            if not len(candidates):
+                results.append([])
+                continue
+            scores = self.matrix[candidates] @ query
+            top = min(k, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            results.append([(int(self.ids[candidates[i]]), float(scores[i])) for i in best])
+        return results
+
+    def flush(self):
+        for mapped in (self.matrix, self.ids, self.assignments):
+            mapped.flush()
+        self.save_meta()
+
+
+def kmeans(data: "np.ndarray", k: int, iterations: int = 10) -> "np.ndarray":
+    """Spherical k-means for unit vectors: assign by dot product, re-normalise the means"""
+    rng = np.random.default_rng(0)
+    centroids = data[rng.choice(len(data), min(k, len(data)), replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(data @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        filled = np.bincount(assignments, minlength=len(centroids)) > 0 # Empty clusters keep their centroid
+        norms = np.linalg.norm(sums[filled], axis=1, keepdims=True)
+        centroids[filled] = sums[filled] / np.maximum(norms, 1e-12)
+    return centroids
+
+
+class IVFReader:
+    """Read-only view of an IVFIndex another worker owns. Its memory-mapped files are
+    mapped read-only and followed through meta.json, which the owner replaces on every
+    change: a new count is picked up, a new capacity remaps the files and a new
+    training reloads the centroids. Vectors this worker adds go to a small exact
+    overlay, and ids it removes to a tombstone set, until the owner's files catch up."""
+
+    def __init__(self, path: str, dim: int = FEATURE_DIM):
+        self.path = path
+        self.dim = dim
+        self.overlay = VectorIndex(dim, capacity=64)
+        self.removed = set() # Ids removed here that the owner's files may still hold
+        self.stamp = None # (inode, mtime) of the meta.json last read
+        self.capacity = 0
+        self.count = 0
+        self.trained_at = None
+        self.matrix = self.ids = self.assignments = self.centroids = None
+        self.refresh()
+
+    def map_array(self, name: str, dtype, shape: tuple):
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r", shape=shape)
+
+    def refresh(self):
+        """Follow the owner's meta.json if it changed since the last look"""
+        meta_path = os.path.join(self.path, "meta.json")
+        try:
+            stat = os.stat(meta_path)
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+            if stamp == self.stamp:
+                return
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["dim"] != self.dim:
+                return
+            if meta["capacity"] != self.capacity:
+                self.matrix = self.map_array("vectors.f32", np.float32, (meta["capacity"], self.dim))
+                self.ids = self.map_array("ids.i64", np.int64, (meta["capacity"],))
+                self.assignments = self.map_array("lists.i32", np.int32, (meta["capacity"],))
+                self.capacity = meta["capacity"]
+                self.count = min(self.count, self.capacity)
+            if meta["trained_at"] != self.trained_at:
+                self.centroids = np.load(os.path.join(self.path, "centroids.npy")) if meta["trained_at"] else None
+                self.trained_at = meta["trained_at"]
+        except (OSError, ValueError, KeyError): # Owner still creating or growing the files, try again next time
+            return
+        self.stamp = stamp
+        self.count = min(meta["count"], self.capacity)
+        self.prune()
+
+    def prune(self):
+        """Drop overlay vectors and tombstones the owner's files have caught up with"""
+        present = self.ids[:self.count]
+        if self.overlay.count:
+            local = self.overlay.ids[:self.overlay.count]
+            for image_id in local[np.isin(local, present)].tolist():
+                self.overlay.remove(image_id)
+        if self.removed:
+            removed = np.fromiter(self.removed, dtype=np.int64, count=len(self.removed))
+            self.removed = set(removed[np.isin(removed, present)].tolist())
+
+    def add(self, image_id: int, vector: "np.ndarray"):
+        self.removed.discard(image_id)
+        self.overlay.add(image_id, vector)
+
+    def remove(self, image_id: int):
+        self.overlay.remove(image_id)
+        self.removed.add(image_id)
+
+    def train_in_background(self):
+        pass # The owner trains
+
+    def flush(self):
+        pass # Nothing here is persisted
+
+    def search(self, queries: "np.ndarray", k: int, nprobe: int = IVFIndex.NPROBE) -> List[List[tuple]]:
+        self.refresh()
+        count = self.count
+        if count and self.centroids is not None:
+            nprobe = min(nprobe, len(self.centroids))
+            probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for i, (query, local) in enumerate(zip(queries, self.overlay.search(queries, k))):
+            scores = dict(local)
+            if count:
+                if self.centroids is None:
+                    rows = np.arange(count)
+                    row_scores = self.matrix[:count] @ query
+                else: # No posting lists here: the owner's assignments are scanned for the probed lists
+                    rows = np.flatnonzero(np.isin(self.assignments[:count], probes[i]))
+                    row_scores = self.matrix[rows] @ query
+                top = min(k + len(self.removed), len(rows)) # Room for tombstoned ids
+                if top:
+                    best = np.argpartition(-row_scores, top - 1)[:top]
+                    for image_id, score in zip(self.ids[rows[best]].tolist(), row_scores[best].tolist()):
+                        scores.setdefault(image_id, score) # The overlay copy wins until pruned
+            ranked = sorted((item for item in scores.items() if item[0] not in self.removed), key=lambda item: -item[1])
+            results.append(ranked[:k])
+        return results
+
+    def similar(self, image_id: int, k: int = SIMILAR_COUNT) -> List[int]:
+        """Ids of the k images most similar to image_id, excluding itself"""
+        self.refresh()
+        if image_id in self.removed:
+            return []
+        row = self.overlay.rows.get(image_id)
+        if row is not None:
+            vector = self.overlay.matrix[row]
+        else:
+            rows = np.flatnonzero(self.ids[:self.count] == image_id) if self.count else []
+            if not len(rows):
+                return []
+            vector = np.array(self.matrix[rows[0]])
+        matches = self.search(vector[None, :], k + 1)[0]
+        return [match_id for match_id, _ in matches if match_id != image_id][:k]
+
+
+def open_vector_index() -> Union[IVFIndex, IVFReader]:
+    """The first worker to start owns the persisted index and is its only writer, since
+    memory-mapped appends are single-writer; it reconciles the index with the store, which
+    every worker writes to, and picks up other workers' vectors from there as they arrive.
+    The other workers read the owner's files."""
+    global vector_index_lock
+    os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+    vector_index_lock = open(os.path.join(VECTOR_INDEX_DIR, ".lock"), "a")
+    try:
+        fcntl.flock(vector_index_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return IVFReader(VECTOR_INDEX_DIR)
+    index = IVFIndex(VECTOR_INDEX_DIR)
+    index.reconcile((image_id, np.frombuffer(features, dtype=np.float32)) for image_id, features in store.iter_features())
+    return index
+
+
+vector_index_lock = None
+vector_index = open_vector_index() if np is not None else None
+
+@app.on_event("shutdown")
+async def flush_vector_index():
+    if vector_index is not None:
+        vector_index.flush()
+
+# --- Near-Duplicate Detection ---
+
+NEAR_DUPLICATE_BITS = 4 # Max Hamming distance between 64-bit hashes to count as the same picture
+
+def dhash(img) -> int:
+    """64-bit difference hash: the sign of horizontal gradients in a 9x8 grayscale thumbnail.
+    Survives resizing and recompression, unlike a byte hash."""
+    pixels = list(img.convert("L").resize((9, 8)).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+class HammingIndex:
+    """Multi-index hashing. Each hash is split into max_distance + 1 chunks with one
+    exact-match table per chunk; by the pigeonhole principle a hash within
+    max_distance bits agrees with the query on at least one chunk, so only those
+    bucket members need a full Hamming check."""
+
+    def __init__(self, max_distance: int = NEAR_DUPLICATE_BITS, bits: int = 64):
+        chunks = max_distance + 1
+        bounds = [bits * i // chunks for i in range(chunks + 1)]
+        self.max_distance = max_distance
+        self.chunks = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])] # (shift, mask)
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in self.chunks]
+        self.hashes: Dict[int, int] = {} # image_id: hash
+
+    def add(self, image_id: int, phash: int):
+        self.remove(image_id)
+        self.hashes[image_id] = phash
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            table.setdefault((phash >> shift) & mask, []).append(image_id)
+
+    def remove(self, image_id: int):
+        phash = self.hashes.pop(image_id, None)
+        if phash is None:
+            return
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            key = (phash >> shift) & mask
+            bucket = table[key]
+            bucket.remove(image_id)
+            if not bucket:
+                del table[key]
+
+    def near(self, phash: int, exclude: Optional[int] = None) -> List[tuple]:
+        """(image_id, distance) for stored hashes within max_distance bits, closest first"""
+        candidates = set()
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            candidates.update(table.get((phash >> shift) & mask, ()))
+        candidates.discard(exclude)
+        matches = [(image_id, (phash ^ self.hashes[image_id]).bit_count()) for image_id in candidates]
+        return sorted((match for match in matches if match[1] <= self.max_distance), key=lambda match: match[1])
+
+    def near_duplicates(self, image_id: int) -> List[tuple]:
+        phash = self.hashes.get(image_id)
+        return [] if phash is None else self.near(phash, exclude=image_id)
+
+
+phash_index = HammingIndex()
+for image_id, phash in store.iter_phashes():
+    phash_index.add(image_id, phash)
+
+# Other workers' uploads whose analysis results have not been seen here yet: image_id: time first seen
+awaiting_analysis: Dict[int, float] = {}
+ANALYSIS_POLL_INTERVAL = 1.0 # Seconds between background catch-ups, see sync_loop
+ANALYSIS_WAIT = 600 # Stop looking after this long (analysis failed, or Pillow is missing there)
+
+async def sync_analysis():
+    """Add the feature vectors and perceptual hashes of images uploaded through other
+    workers once their analysis is done. The hash is written last, so it marks completion."""
+    if not awaiting_analysis:
+        return
+    now = time.monotonic()
+    for image_id, seen_at in list(awaiting_analysis.items()):
+        phash = await store.run(store.get_phash, image_id)
+        if phash is not None:
+            features = await store.run(store.get_features, image_id)
+            if features is not None and vector_index is not None:
+                vector_index.add(image_id, np.frombuffer(features, dtype=np.float32))
+            phash_index.add(image_id, phash)
+        if phash is not None or now - seen_at > ANALYSIS_WAIT:
+            del awaiting_analysis[image_id]
+    if vector_index is not None:
+        vector_index.train_in_background()
+
+async def sync_loop():
+    """Catch up with other workers off the request path: idle workers stay current, and
+    analysis results and comments are picked up without a request waiting on them"""
+    while True:
+        await asyncio.sleep(ANALYSIS_POLL_INTERVAL)
+        try:
+            await sync_indexes(force=True)
+            await sync_comments()
+            await sync_analysis()
+        except Exception as e:
+            print(f"Background sync failed: {e}")
+
+sync_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_sync_loop():
+    global sync_task
+    sync_task = asyncio.create_task(sync_loop())
+
+@app.on_event("shutdown")
+async def stop_sync_loop():
+    if sync_task is not None:
+        sync_task.cancel()
+
+# --- Like Counters ---
+
+LIKE_FLUSH_INTERVAL = 0.2 # Seconds between write-behind flushes
+LIKE_FLUSH_EVENTS = 1000 # Flush early once this many like/unlike events are buffered
+LIKE_COUNT_CACHE_SIZE = 100000
+LIKE_COUNT_MAX_AGE = 1.0 # Seconds a cached persisted count is used before it is read again (other workers flush too)
+class LikeBuffer:
+    """Write-behind buffer for like/unlike. Each user's latest state per image is kept
+    in memory and written with one batched transaction every LIKE_FLUSH_INTERVAL seconds
+    or LIKE_FLUSH_EVENTS events, so a viral pin costs one row update per flush instead
+    of one per click. Liking twice is a no-op. Responses carry the optimistic count:
+    last persisted count plus whatever is buffered or being written. Each worker's
+    deltas act as its own sub-counter of a hot image's count, summed into one row update
+    per flush; splitting the row itself would not help, since SQLite takes one write
+    lock for the whole database. After each flush the written totals, which include
+    other workers' likes, go to on_flush."""
+
+    def __init__(self, repo: Repository, likes: LikeIndex):
+        self.repo = repo
+        self.likes = likes # Only ever holds states the store confirmed
+        self.pending: Dict[tuple, bool] = {} # (image_id, user_id): liked state not yet written
+        self.writing: Dict[tuple, bool] = {} # The batch a flush is writing right now
+        self.deltas: Dict[int, int] = {} # image_id: count change the pending states imply
+        self.inflight: Dict[int, int] = {} # image_id: count change being written right now
+        self.counts: Dict[int, tuple] = {} # image_id: (last persisted count seen, monotonic time seen)
+        self.events = 0
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.on_flush = None # Called with (image_id, count) for every image a flush wrote
+
+    def unwritten(self, image_id: int) -> int:
+        return self.deltas.get(image_id, 0) + self.inflight.get(image_id, 0)
+
+    def current(self, image_id: int, persisted: int) -> int:
+        """Count to display given a freshly read persisted count"""
+        return max(persisted + self.unwritten(image_id), 0)
+
+    async def persisted(self, image_id: int, refresh: bool = False) -> Optional[int]:
+        """Last persisted count, read again once older than LIKE_COUNT_MAX_AGE; None if the image is missing"""
+        cached = self.counts.get(image_id)
+        if refresh or cached is None or time.monotonic() - cached[1] > LIKE_COUNT_MAX_AGE:
+            img = await self.repo.run(self.repo.get_image, image_id, with_comments=False)
+            if img is None:
+                self.counts.pop(image_id, None)
+                return None
+            if len(self.counts) >= LIKE_COUNT_CACHE_SIZE:
+                self.counts.clear()
+            cached = self.counts[image_id] = (img['likes'], time.monotonic())
+        return cached[0]
+
+    def unwritten_state(self, key: tuple) -> Optional[bool]:
+        """The user's latest like state not yet in the store, None if there is none"""
+        return self.pending.get(key, self.writing.get(key))
+
+    async def confirm(self, image_id: int, user_id: int) -> bool:
+        """Ask the store whether the user likes the image, and remember the answer"""
+        liked = await self.repo.run(self.repo.is_liked, image_id, user_id)
+        self.likes.set_liked(image_id, user_id, liked)
+        return liked
+
+    async def liked(self, image_id: int, user_id: int) -> bool:
+        """Whether the user likes the image, for the badge and buttons: their buffered state
+        if any, otherwise the store's, since the cache misses other workers' changes"""
+        state = self.unwritten_state((image_id, user_id))
+        if state is not None:
+            return state
+        liked = await self.confirm(image_id, user_id)
+        state = self.unwritten_state((image_id, user_id)) # A click may have landed meanwhile
+        return liked if state is None else state
+
+    async def set_liked(self, image_id: int, user_id: int, liked: bool) -> Optional[int]:
+        """Buffer a like or unlike, return the optimistic count or None if the image is missing"""
+        persisted = await self.persisted(image_id)
+        if persisted is None:
+            return None
+        key = (image_id, user_id)
+        state = self.unwritten_state(key)
+        if state is None and self.likes.liked(image_id, user_id) == liked:
+            # A no-op as far as the cache knows, but the like may have been made or removed
+            # through another worker, so ask the store before dropping the change
+            if await self.confirm(image_id, user_id) != liked: # Missed a change, so the cached count is suspect too
+                persisted = await self.persisted(image_id, refresh=True)
+                if persisted is None:
+                    return None
+            state = self.unwritten_state(key) # A click may have landed meanwhile
+        if state is None:
+            state = self.likes.liked(image_id, user_id)
+        if state != liked:
+            self.pending[key] = liked
+            self.deltas[image_id] = self.deltas.get(image_id, 0) + (1 if liked else -1)
+            self.events += 1
+            if self.events >= LIKE_FLUSH_EVENTS:
+                self.wake.set()
+        return self.current(image_id, persisted)
+
+    def forget(self, image_id: int):
+        """Drop buffered state for a deleted image"""
+        self.pending = {key: liked for key, liked in self.pending.items() if key[0] != image_id}
+        self.deltas.pop(image_id, None)
+        self.counts.pop(image_id, None)
+        self.likes.remove(image_id)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, deltas = self.pending, self.deltas
+        self.pending, self.deltas, self.events = {}, {}, 0
+        self.inflight, self.writing = deltas, batch
+        try:
+            written = await self.repo.run(self.repo.apply_like_changes, batch)
+        except Exception as e:
+            # Put the changes back (newer states win) so the next flush retries them
+            for key, liked in batch.items():
+                self.pending.setdefault(key, liked)
+            for image_id, delta in deltas.items():
+                self.deltas[image_id] = self.deltas.get(image_id, 0) + delta
+            print(f"Like flush failed, will retry: {e}")
+            return
+        finally:
+            self.inflight, self.writing = {}, {}
+        # The store now holds exactly the batch's states for every image that still exists
+        for (image_id, user_id), liked in batch.items():
+            if image_id in written:
+                self.likes.set_liked(image_id, user_id, liked)
+        now = time.monotonic()
+        for image_id in deltas:
+            if image_id in written:
+                self.counts[image_id] = (written[image_id], now)
+                if self.on_flush is not None:
+                    self.on_flush(image_id, self.current(image_id, written[image_id]))
+            else: # Deleted meanwhile
+                self.counts.pop(image_id, None)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), LIKE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.flush()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the flush loop and write whatever is still buffered"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+
+if isinstance(store, InMemoryRepository):
+    like_index = store.likes # Same process, so the store's own sets are always current
+else:
+    like_index = LikeIndex()
+    like_index.rebuild(store.iter_likes())
+like_buffer = LikeBuffer(store, like_index)
+
+@app.on_event("startup")
+async def start_like_buffer():
+    like_buffer.start()
+
+@app.on_event("shutdown")
+async def flush_like_buffer():
+    await like_buffer.stop()
+
+# --- Live Updates ---
+
+LIVE_PUSH_INTERVAL = 0.25 # At most one push per image this often
+LIVE_HEARTBEAT = 30 # Seconds between keep-alive comments on idle streams
+LIVE_POLL_INTERVAL = 0.5 # Seconds between looks for comments posted through other workers, while anyone is watching
+LIVE_HISTORY = 16 # Pushes kept per image for subscribers that fall behind
+LIVE_MAX_CONNECTIONS = 10000 # Per worker
+
+
+def sse_event(event: str, data: str) -> str:
+    """One Server-Sent Events message; every line of data gets its own data: field"""
+    return f"event: {event}\n" + "".join(f"data: {line}\n" for line in data.splitlines() or [""]) + "\n"
+
+
+class LiveChannel:
+    """Push state for one image. Subscribers share a single Event that is swapped on
+    every push, so an idle connection costs one suspended coroutine and no queue."""
+    __slots__ = ("seq", "likes", "likes_seq", "history", "changed", "subscribers",
+                 "pending_likes", "pending_comments", "timer", "last_push")
+
+    def __init__(self):
+        self.seq = 0
+        self.likes = None # Latest like count pushed
+        self.likes_seq = 0
+        self.history = deque(maxlen=LIVE_HISTORY) # (seq, [(client, comment HTML)])
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+        self.pending_likes = None
+        self.pending_comments = []
+        self.timer = None
+        self.last_push = 0.0
+
+    def message_since(self, seq: int, client: str) -> str:
+        """Everything pushed after seq, minus comments this client posted itself"""
+        parts = []
+        if self.likes_seq > seq:
+            parts.append(sse_event("likes", f"{self.likes} Likes"))
+        for pushed, comments in self.history:
+            if pushed > seq:
+                parts.extend(sse_event("comment", html) for author, html in comments if not client or author != client)
+        return "".join(parts)
+
+
+class LiveUpdates:
+    """Per-image fan-out of like counts and new comments to detail page viewers over SSE.
+    Publishes are coalesced to one push per LIVE_PUSH_INTERVAL per image, and images
+    nobody is watching cost nothing. Comments posted through other workers are found by
+    polling the store (the poll hook) while this worker has viewers; like counts are
+    pushed by the worker the like went through."""
+
+    def __init__(self):
+        self.channels: Dict[int, LiveChannel] = {}
+        self.connections = 0
+        self.task: Optional[asyncio.Task] = None
+        self.poll = None # Coroutine function that publishes other workers' comments via publish_synced_comment
+        self.published = set() # Ids of comments already published here, skipped when the poll finds them
+
+    def publish_likes(self, image_id: int, likes: int):
+        channel = self.channels.get(image_id)
+        if channel is not None:
+            channel.pending_likes = likes
+            self.schedule(channel)
+
+    def publish_comment(self, image_id: int, html: str, client: str = "", comment_id: Optional[int] = None):
+        channel = self.channels.get(image_id)
+        if channel is not None:
+            channel.pending_comments.append((client, html))
+            self.schedule(channel)
+            if comment_id is not None:
+                self.published.add(comment_id)
+
+    def publish_synced_comment(self, image_id: int, comment: Dict):
+        """A comment found by catching up with the store, pushed unless it was published here already"""
+        if comment["id"] in self.published:
+            self.published.discard(comment["id"])
+        elif image_id in self.channels:
+            self.publish_comment(image_id, render_comment(comment))
+
+    def forget_published(self, comment_id: int):
+        """Drop published ids the catch-up has moved past (their image was deleted before it got there)"""
+        if self.published:
+            self.published = {published for published in self.published if published > comment_id}
+
+    def schedule(self, channel: LiveChannel):
+        if channel.timer is None:
+            loop = asyncio.get_running_loop()
+            delay = max(channel.last_push + LIVE_PUSH_INTERVAL - loop.time(), 0)
+            channel.timer = loop.call_later(delay, self.push, channel)
+
+    def push(self, channel: LiveChannel):
+        channel.timer = None
+        channel.last_push = asyncio.get_running_loop().time()
+        channel.seq += 1
+        if channel.pending_likes is not None:
+            channel.likes, channel.likes_seq, channel.pending_likes = channel.pending_likes, channel.seq, None
+        if channel.pending_comments:
+            channel.history.append((channel.seq, channel.pending_comments))
+            channel.pending_comments = []
+        self.wake(channel)
+
+    @staticmethod
+    def wake(channel: LiveChannel):
+        changed, channel.changed = channel.changed, asyncio.Event()
+        changed.set()
+
+    async def heartbeat(self):
+        """Poll for other workers' comments while anyone is watching, and wake every channel
+        periodically so subscribers with nothing new send a keep-alive. One loop for all
+        connections instead of a timeout per connection."""
+        idle = 0.0
+        while True:
+            await asyncio.sleep(LIVE_POLL_INTERVAL)
+            if self.channels and self.poll is not None:
+                try:
+                    await self.poll()
+                except Exception as e:
+                    print(f"Live comment poll failed: {e}")
+            idle += LIVE_POLL_INTERVAL
+            if idle >= LIVE_HEARTBEAT:
+                idle = 0.0
+                for channel in list(self.channels.values()):
+                    self.wake(channel)
+
+    def start(self):
+        self.task = asyncio.create_task(self.heartbeat())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def stream(self, image_id: int, client: str = ""):
+        """SSE body for one viewer; ends when the client disconnects"""
+        channel = self.channels.get(image_id)
+        if channel is None:
+            channel = self.channels[image_id] = LiveChannel()
+        channel.subscribers += 1
+        self.connections += 1
+        seq = channel.seq
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                if channel.seq == seq:
+                    await channel.changed.wait()
+                    if channel.seq == seq: # Heartbeat, nothing new
+                        yield ": ping\n\n"
+                        continue
+                # A viewer more than LIVE_HISTORY pushes behind misses older comments, not the count
+                message = channel.message_since(seq, client)
+                seq = channel.seq
+                if message:
+                    yield message
+        finally:
+            channel.subscribers -= 1
+            self.connections -= 1
+            if not channel.subscribers and self.channels.get(image_id) is channel:
+                if channel.timer is not None:
+                    channel.timer.cancel()
+                del self.channels[image_id]
+
+
+live_updates = LiveUpdates()
+like_buffer.on_flush = live_updates.publish_likes # Viewers get the corrected total once a flush lands
+live_updates.poll = sync_comments
+
+@app.on_event("startup")
+async def start_live_updates():
+    live_updates.start()
+
+@app.on_event("shutdown")
+async def stop_live_updates():
+    live_updates.stop()
+
+# --- Sessions ---
+
+def sign_session(user_id: int) -> str:
+    """Cookie value "<user_id>.<hmac>", so the id cannot be changed client-side"""
+    mac = hmac.new(SESSION_SECRET.encode(), str(user_id).encode(), hashlib.sha256).hexdigest()
+    return f"{user_id}.{mac}"
+
+def session_user_id(request: Request) -> Optional[int]:
+    """Signed-in user's id from the session cookie, or None"""
+    value = request.cookies.get(SESSION_COOKIE, "")
+    user_id = value.partition(".")[0]
+    if not user_id.isdigit() or not hmac.compare_digest(sign_session(int(user_id)), value):
+        return None
+    return int(user_id)
+
+def signed_in_redirect(user_id: int) -> RedirectResponse:
+    """Redirect to the feed with a fresh session cookie"""
+    response = RedirectResponse(url="/", status_code=303)
+    response.set_cookie(SESSION_COOKIE, sign_session(user_id), max_age=SESSION_MAX_AGE, httponly=True, samesite="lax")
+    return response
+
+def sign_up_required() -> HTMLResponse:
+    """HTMX actions that need a user send anonymous visitors to the sign-up page"""
+    return HTMLResponse("", status_code=401, headers={"HX-Redirect": "/signup"})
 
 # --- Helper Functions ---
 
-def render_page(*content, title="Simple UI"):
+def build_page(*content, title="Simple UI"):
     """Wraps content in basic HTML structure with HTMX"""
-    return HTMLResponse(str(
-        Html(
-            Head(
-                Title(title),
-                Meta(charset="utf-8"),
-                Meta(name="viewport", content="width=device-width, initial-scale=1"),
-                Script(src="https://unpkg.com/htmx.org@1.9.12"), # Include HTMX
-                # Basic CSS for layout
-                Style("""
-                    body { font-family: sans-serif; margin: 0; padding: 20px; background-color: #f4f4f4; }
-                    .container { max-width: 900px; margin: auto; background: white; padding: 20px; box-shadow: 0 0 10px rgba(0,0,0,0.1); }
-                    .header { display: flex; justify-content: space-between; align-items: center; padding-bottom: 15px; border-bottom: 1px solid #ccc; margin-bottom: 20px; }
-                    .header input[type='search'] { flex-grow: 1; margin: 0 15px; padding: 8px; }
-                    .header button, .header a { padding: 8px 12px; text-decoration: none; background-color: #eee; border: 1px solid #ccc; border-radius: 4px; cursor: pointer; }
-                    .header a { display: inline-block; }
-                    .image-grid { display: grid; grid-template-columns: repeat(auto-fill, minmax(200px, 1fr)); gap: 15px; margin-bottom: 20px; }
-                    .image-grid-item img { max-width: 100%; height: auto; display: block; border: 1px solid #ddd; }
-                    .image-detail { display: flex; gap: 20px; }
-                    .image-detail img { max-width: 60%; height: auto; object-fit: contain; border: 1px solid #ddd; }
-                    .image-info { flex-grow: 1; }
-                    .actions button { margin-right: 10px; padding: 5px 10px; }
-                    .comments-section { margin-top: 20px; }
-                    .comments-list { list-style: none; padding: 0; margin-bottom: 15px; }
-                    .comments-list li { padding: 8px; border-bottom: 1px solid #eee; }
-                    .comment-form input { width: calc(100% - 80px); padding: 8px; }
-                    .comment-form button { padding: 8px 15px; }
-                    .modal { position: fixed; top: 0; left: 0; width: 100%; height: 100%; background-color: rgba(0,0,0,0.5); display: flex; justify-content: center; align-items: center; z-index: 1000;}
-                    .modal-content { background: white; padding: 30px; border-radius: 5px; min-width: 300px; max-width: 500px; }
-                    .hidden { display: none; }
-                """)
-            ),
-            Body(
-                Div(*content, Class="container"),
-                Div(id="modal-container") # Target for modal content
-            )
+    return Html(
+        Head(
+            Title(title),
+            Meta(charset="utf-8"),
+            Meta(name="viewport", content="width=device-width, initial-scale=1"),
+            Script(src="https://unpkg.com/htmx.org@1.9.12"), # Include HTMX
+            Script(src="https://unpkg.com/htmx.org@1.9.12/dist/ext/sse.js"), # Live updates on the detail page
+            Link(rel="stylesheet", href=CSS_URL), # Fingerprinted, cached until the next deploy
+        ),
+        Body(
+            Div(*content, Class="container"),
+            Div(id="modal-container") # Target for modal content
         )
-    ))
+    )
+
+
+# Slots marking where the per-request parts go in the pre-rendered shell
+_TITLE_SLOT = "__PAGE_TITLE_SLOT__"
+_BODY_SLOT = "__PAGE_BODY_SLOT__"
+
+def render_shell():
+    """Render the invariant document once and split it around the title and body slots"""
+    document = to_xml(build_page(_BODY_SLOT, title=_TITLE_SLOT))
+    head, rest = document.split(_TITLE_SLOT)
+    middle, tail = rest.split(_BODY_SLOT)
+    return head, middle, tail
+
+PAGE_SHELL = render_shell()
+
+def render_page(*content, title="Simple UI"):
+    """Splice the per-request content into the pre-rendered page shell"""
+    head, middle, tail = PAGE_SHELL
+    body = "".join(map(to_xml, content))
+    return HTMLResponse(head + escape(title) + middle + body + tail)
+
+def render_picture(img_data: Dict, sizes: str, fallback_width: int, lazy: bool = True):
+    """Responsive image: WebP and JPEG srcsets over the generated variants, the original until they exist"""
+    srcsets = {}
+    for name, url in img_data['variants'].items():
+        fmt, width = name.split("-")
+        srcsets.setdefault(fmt, []).append((int(width), url))
+    for candidates in srcsets.values():
+        candidates.sort()
+    jpgs = srcsets.get("jpg", [])
+    # Plain src for browsers without srcset support: the smallest JPEG at least fallback_width wide
+    src = next((url for width, url in jpgs if width >= fallback_width), jpgs[-1][1] if jpgs else img_data['url'])
+    img = Img(
+        src=src,
+        alt=img_data['description'],
+        srcset=", ".join(f"{url} {width}w" for width, url in jpgs) or None,
+        sizes=sizes if jpgs else None,
+        width=img_data['width'], height=img_data['height'], # Reserves the box, no layout shift
+        loading="lazy" if lazy else "eager",
+        decoding="async"
+    )
+    if "webp" not in srcsets:
+        return img
+    webp_srcset = ", ".join(f"{url} {width}w" for width, url in srcsets["webp"])
+    return Picture(Source(type="image/webp", srcset=webp_srcset, sizes=sizes), img)
+
+# --- Page Cache ---
+
+class PageCache:
+    """Rendered response bodies keyed by route and page parameters, least recently used
+    evicted first within an entry count and a byte budget. Nothing expires on its own:
+    the cache is cleared when the store's feed version moves, so uploads, deletes and
+    new variants from any worker are picked up, and straight away on this worker's own."""
+
+    def __init__(self, max_entries: int = PAGE_CACHE_ENTRIES, max_bytes: int = PAGE_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key: body bytes
+        self.bytes = 0
+        self.version = None # Feed version the entries were rendered at
+
+    def sync(self, version: int):
+        if version != self.version:
+            self.invalidate()
+            self.version = version
+
+    def get(self, key) -> Optional[bytes]:
+        body = self.entries.get(key)
+        if body is not None:
+            self.entries.move_to_end(key)
+        return body
+
+    def put(self, key, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self.entries[key] = body
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes or len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def invalidate(self):
+        self.entries.clear()
+        self.bytes = 0
+
+
+page_cache = PageCache()
+
+# --- Components ---
+# Hot fragments are built once as FastHTML trees with slot markers and compiled to
+# str.format templates, so rendering one is a single format call, not a tree walk.
+# The *_tree functions are the only definitions of each fragment's markup.
+
+def slot(name: str) -> str:
+    return f"__SLOT_{name}__"
+
+def compile_template(component) -> str:
+    """str.format template from a component rendered with slot() markers in place of values"""
+    html = to_xml(component).replace("{", "{{").replace("}", "}}")
+    return re.sub(r"__SLOT_(\w+)__", r"{\1}", html)
+
+
+LIKED_BADGE = "You liked this"
+
+def like_section_tree(img_id, likes, badge, oob: bool = False):
+    # Both buttons are always present; CSS shows the one matching the badge, so a
+    # like only changes the count and badge text. In oob mode those two are updated
+    # out of band and the buttons swap nothing themselves.
+    swap = {"hx_swap": "none"} if oob else {"hx_target": f"#likes-{img_id}", "hx_swap": "outerHTML"}
+    mode = "?oob=1" if oob else ""
+    return Span(
+        Span(f"{likes} Likes", id=f"like-count-{img_id}", sse_swap="likes"), # Also refreshed by the event stream
+        Span(badge, id=f"liked-badge-{img_id}", Class="liked-badge"),
+        Button("Like", hx_post=f"/like/{img_id}{mode}", Class="like-button", **swap),
+        Button("Unlike", hx_post=f"/unlike/{img_id}{mode}", Class="unlike-button", **swap),
+        id=f"likes-{img_id}"
+    )
+
+def like_oob_tree(img_id, likes, badge):
+    return (Span(f"{likes} Likes", id=f"like-count-{img_id}", hx_swap_oob="innerHTML"),
+            Span(badge, id=f"liked-badge-{img_id}", hx_swap_oob="innerHTML"))
+
+def comment_tree(author, body, posted):
+    return Li(Strong(author), " ", body, Small(posted, Class="comment-time"))
+
+def comments_list_tree(img_id, items):
+    # New comments, from the form or other viewers over the event stream, go on top
+    return Ul(items, id=f"comments-list-{img_id}", Class="comments-list", sse_swap="comment", hx_swap="afterbegin")
+
+
+LIKE_SECTION_TEMPLATES = {oob: compile_template(like_section_tree(slot("img_id"), slot("likes"), slot("badge"), oob)) for oob in (False, True)}
+LIKE_OOB_TEMPLATE = "".join(compile_template(part) for part in like_oob_tree(slot("img_id"), slot("likes"), slot("badge")))
+COMMENT_TEMPLATE = compile_template(comment_tree(slot("author"), slot("body"), slot("posted")))
+COMMENTS_LIST_TEMPLATE = compile_template(comments_list_tree(slot("img_id"), slot("items")))
+NO_COMMENTS = to_xml(Li("No comments yet.", Class="no-comments"))
+
+def render_like_section(img_id: int, likes: int, liked: bool, oob: bool = False) -> str:
+    return LIKE_SECTION_TEMPLATES[oob].format(img_id=img_id, likes=likes, badge=LIKED_BADGE if liked else "")
+
+def render_like_oob(img_id: int, likes: int, liked: bool) -> str:
+    """Out-of-band updates for the like count and the "you liked this" badge"""
+    return LIKE_OOB_TEMPLATE.format(img_id=img_id, likes=likes, badge=LIKED_BADGE if liked else "")
+
+def render_comment(comment: Dict) -> str:
+    posted = time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime(comment['created_at']))
+    return COMMENT_TEMPLATE.format(author=escape(comment['author'] or "Anonymous"), body=escape(comment['body']), posted=posted)
+
+def render_comments_list(img_id: int, items: List[str]) -> str:
+    """items are rendered list items, e.g. render_comment output"""
+    return COMMENTS_LIST_TEMPLATE.format(img_id=img_id, items="".join(items) or NO_COMMENTS)
 
 # --- Page Endpoints ---
 
 @app.get("/signup", response_class=HTMLResponse)
 async def signup_page():
     """Page 1: Sign-up Form"""
-    form_content = Form(
+    form_content = HtmlForm(
         H2("Sign Up"),
         P(Label("Username:", fr="username"), Input(type="text", id="username", name="username", required=True)),
         P(Label("Email:", fr="email"), Input(type="email", id="email", name="email", required=True)),
         P(Label("Password:", fr="password"), Input(type="password", id="password", name="password", required=True)),
         Button("Sign Up", type="submit"),
+        P("Already signed up? ", A("Log in", href="/login")),
         action="/signup", method="post" # Post to the signup handler
     )
     return render_page(form_content, title="Sign Up")
@@ -83,146 +2889,277 @@ async def signup_page():
 @app.post("/signup")
 async def handle_signup(username: str = Form(...), email: str = Form(...), password: str = Form(...)):
     """Handle sign-up form submission"""
-    if username in users:
+    # NOTE: Store hashed passwords in reality!
+    user_id = await store.run(store.add_user, username, email, password)
+    if user_id is None:
         # Ideally, return an error message on the form page using HTMX
         raise HTTPException(status_code=400, detail="Username already exists")
-    users[username] = {"email": email, "password": password} # NOTE: Store hashed passwords in reality!
     print(f"New user signed up: {username}, {email}")
-    # Redirect to the main feed after sign-up
-    return RedirectResponse(url="/", status_code=303)
+    # Redirect to the main feed after sign-up, signed in
+    return signed_in_redirect(user_id)
 
+@app.get("/login", response_class=HTMLResponse)
+async def login_page():
+    """Log-in form for existing users, e.g. after their session cookie stopped being accepted"""
+    form_content = HtmlForm(
+        H2("Log In"),
+        P(Label("Username:", fr="username"), Input(type="text", id="username", name="username", required=True)),
+        P(Label("Password:", fr="password"), Input(type="password", id="password", name="password", required=True)),
+        Button("Log In", type="submit"),
+        P("New here? ", A("Sign up", href="/signup")),
+        action="/login", method="post"
+    )
+    return render_page(form_content, title="Log In")
 
-@app.get("/", response_class=HTMLResponse)
-async def feed_page():
-    """Page 2: Main Feed / Dashboard"""
-    header = Div(
+@app.post("/login")
+async def handle_login(username: str = Form(...), password: str = Form(...)):
+    """Handle log-in form submission"""
+    user = await store.run(store.get_user, username)
+    # NOTE: Compare password hashes in reality!
+    if user is None or not hmac.compare_digest(user["password"].encode(), password.encode()):
+        raise HTTPException(status_code=401, detail="Wrong username or password")
+    return signed_in_redirect(user["id"])
+
+
+def render_header(q: str = ""):
+    return Div(
         Button("Post", hx_get="/post-form", hx_target="#modal-container", hx_swap="innerHTML"), # Load form into modal
-        fasthtml.components.Input(type="search", placeholder="Search", name="q"), # Use explicit import due to name clash
+        HtmlForm( # Enter submits the search, typing fetches suggestions into the datalist
+            Input(
+                type="search", placeholder="Search", name="q", value=q, list="search-suggestions", autocomplete="off",
+                hx_get="/autocomplete", hx_trigger="keyup changed delay:150ms", hx_target="#search-suggestions", hx_swap="innerHTML"
+            ),
+            Datalist(id="search-suggestions"),
+            hx_get="/search", hx_target="#image-grid", hx_swap="innerHTML"
+        ),
         A("User Profile", href="#"), # Simple link for now
         Class="header"
     )
 
-    image_grid_items = []
-    # Sort images by ID descending to show newest first (optional)
-    sorted_image_ids = sorted(images.keys(), reverse=True)
-    for img_id in sorted_image_ids:
-        img_data = images[img_id]
-        image_grid_items.append(
-            A(
-                Img(src=img_data['url'], alt=img_data['description']),
-                href=f"/image/{img_id}",
-                Class="image-grid-item"
-            )
-        )
 
-    image_grid = Div(*image_grid_items, Class="image-grid")
+def render_grid_item(img_data: Dict, lazy: bool = True):
+    return A(
+        render_picture(img_data, FEED_IMAGE_SIZES, FEED_IMAGE_WIDTH, lazy=lazy),
+        href=f"/image/{img_data['id']}",
+        Class="image-grid-item"
+    )
+
+
+async def render_feed_items(cursor: Optional[int], limit: int) -> list:
+    """One page of grid items, followed by a sentinel that loads the next page when scrolled into view"""
+    image_ids = feed_index.page(cursor, limit)
+    items = [
+        # Only the first row of the first page loads eagerly, the rest when scrolled near
+        render_grid_item(img_data, lazy=cursor is not None or position >= 4)
+        for position, img_data in enumerate(await store.run(store.get_images, image_ids))
+    ]
+    if len(image_ids) == limit: # Possibly more pages; the last id is the next cursor
+        items.append(Div(
+            hx_get=f"/?cursor={image_ids[-1]}&limit={limit}",
+            hx_trigger="revealed",
+            hx_swap="outerHTML", # The next page replaces the sentinel inside the grid
+            Class="feed-sentinel"
+        ))
+    return items
+
+
+@app.get("/", response_class=HTMLResponse)
+async def feed_page(request: Request, cursor: Optional[int] = None, limit: int = FEED_PAGE_SIZE):
+    """Page 2: Main Feed / Dashboard"""
+    limit = max(1, min(limit, FEED_MAX_PAGE_SIZE))
+    await sync_indexes() # Clears the page cache if any worker changed the feed
+    partial = cursor is not None and bool(request.headers.get("HX-Request"))
+    # The feed has no per-user state, so signed-in visitors share the cached pages
+    key = ("/", cursor, limit, partial)
+    body = page_cache.get(key)
+    if body is not None:
+        return HTMLResponse(body)
+
+    if partial:
+        # Infinite scroll: return just the next page of grid items
+        response = HTMLResponse("".join(map(to_xml, await render_feed_items(cursor, limit))))
+    else:
+        # Newest first, one page at a time
+        image_grid = Div(*await render_feed_items(cursor, limit), id="image-grid", Class="image-grid")
+        response = render_page(render_header(), image_grid, title="Feed")
+    page_cache.put(key, response.body)
+    return response
+
+
+@app.get("/autocomplete", response_class=HTMLResponse)
+async def autocomplete(q: str = ""):
+    """Datalist options for the search box, answered from the prefix indexes"""
+    return HTMLResponse("".join(to_xml(Option(value=suggestion)) for suggestion in suggest(q)))
 
-    return render_page(header, image_grid, title="Feed")
+
+@app.get("/search", response_class=HTMLResponse)
+async def search_page(request: Request, q: str = ""):
+    """Full-text search over descriptions and comments; HTMX requests get just the grid items"""
+    await sync_indexes()
+    await sync_comments()
+    if q.strip():
+        image_ids = search_index.search(q)
+        items = [render_grid_item(img_data, lazy=position >= 4) for position, img_data in enumerate(await store.run(store.get_images, image_ids))]
+        items = items or [P("No pins found.", Class="no-results")]
+        query = " ".join(tokenize(q))
+        if image_ids and len(query) <= QUERY_SUGGESTION_LENGTH: # Only queries that found something become suggestions
+            query_suggestions.set_weight(query, query_suggestions.weights.get(query, 0) + 1)
+    else: # Cleared search box: back to the feed
+        items = await render_feed_items(None, FEED_PAGE_SIZE)
+
+    if request.headers.get("HX-Request"):
+        return HTMLResponse("".join(map(to_xml, items)))
+    image_grid = Div(*items, id="image-grid", Class="image-grid")
+    return render_page(render_header(q), image_grid, title=f"Search: {q}" if q else "Feed")
+
+
+def render_near_duplicates(image_id: int):
+    """Links to pins that look like resized or recompressed copies of this one"""
+    duplicates = phash_index.near_duplicates(image_id)
+    if not duplicates:
+        return ""
+    links = [A(f"#{dup_id}", href=f"/image/{dup_id}") for dup_id, _ in duplicates[:5]]
+    return P("Possible duplicate of ", *links, Class="near-duplicates")
+
+
+async def render_comment_items(image_id: int, before: Optional[int], limit: int) -> Optional[List[str]]:
+    """One page of comments, newest first, followed by a "load more" item that fetches the
+    older ones in its place; None if the image is missing"""
+    comments = await store.run(store.get_comments, image_id, before, limit)
+    if comments is None:
+        return None
+    items = [render_comment(comment) for comment in comments]
+    if len(comments) == limit: # Possibly more; the oldest id shown is the next cursor
+        items.append(to_xml(Li(
+            Button("Load more comments", hx_get=f"/comments/{image_id}?before={comments[-1]['id']}&limit={limit}",
+                   hx_target="closest li", hx_swap="outerHTML"),
+            Class="comments-more"
+        )))
+    return items
 
 
 @app.get("/image/{image_id}", response_class=HTMLResponse)
-async def image_detail_page(image_id: int):
+async def image_detail_page(image_id: int, request: Request):
     """Page 3: Image Detail View"""
-    if image_id not in images:
+    img_data = await store.run(store.get_image, image_id, with_comments=False)
+    if img_data is None:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    img_data = images[image_id]
-
-    # --- Components for HTMX updates ---
-    def render_like_section(img_id: int, current_likes: int):
-        return Span(
-            f"{current_likes} Likes",
-            Button("Like", hx_post=f"/like/{img_id}", hx_target=f"#likes-{img_id}", hx_swap="outerHTML"),
-            Button("Unlike", hx_post=f"/unlike/{img_id}", hx_target=f"#likes-{img_id}", hx_swap="outerHTML"),
-            id=f"likes-{img_id}"
-        )
-
-    def render_comments_list(img_id: int, comments: List[str]):
-        list_items = [Li(comment) for comment in comments] if comments else [Li("No comments yet.")]
-        return Ul(*list_items, id=f"comments-list-{img_id}", Class="comments-list")
-    # --- End HTMX Components ---
+    user_id = session_user_id(request)
+    liked = user_id is not None and await like_buffer.liked(image_id, user_id)
+    client = secrets.token_urlsafe(8) # Identifies this tab, so its own comments are not pushed back to it
+    comment_items = await render_comment_items(image_id, None, COMMENTS_PAGE_SIZE)
 
     image_display = Div(
-        Img(src=img_data['url'], alt=img_data['description']),
+        render_picture(img_data, DETAIL_IMAGE_SIZES, DETAIL_IMAGE_WIDTH, lazy=False),
         Class="image-main"
     )
 
     image_info = Div(
         H2("Image Details"),
         P(img_data['description']),
-        Div(render_like_section(image_id, img_data['likes']), Class="actions"),
+        render_near_duplicates(image_id),
+        Div(NotStr(render_like_section(image_id, like_buffer.current(image_id, img_data['likes']), liked, oob=True)), Class="actions"),
         Div(
             H3("Comments"),
-            Div(render_comments_list(image_id, img_data['comments'])), # Initial comments list
-            Form( # Comment submission form
+            Div(NotStr(render_comments_list(image_id, comment_items or []))), # Newest page of comments
+            HtmlForm( # Comment submission form
                 Input(type="text", name="comment", placeholder="Add a comment...", required=True),
                 Button("Post", type="submit"),
                 hx_post=f"/comment/{image_id}",
                 hx_target=f"#comments-list-{image_id}", # Target the list for updates
-                hx_swap="outerHTML", # Replace the whole list UL
+                hx_swap="afterbegin", # Prepend just the new comment
+                hx_vals=json.dumps({"client": client}),
                 hx_on="htmx:afterRequest: this.reset()" # Clear form after submit
             ),
             Class="comments-section"
         ),
-        Class="image-info"
+        # Only the uploader sees (and may use) the delete button
+        HtmlForm(Button("Delete", type="submit"), action=f"/delete/{image_id}", method="post") if user_id is not None and img_data['owner'] == user_id else "",
+        Class="image-info",
+        hx_ext="sse", sse_connect=f"/image/{image_id}/events?client={client}" # Live likes and comments
     )
 
     content = Div(image_display, image_info, Class="image-detail")
-    return render_page(content, title=f"Image {image_id}")
+
+    similar_ids = vector_index.similar(image_id) if vector_index is not None else []
+    if not similar_ids:
+        return render_page(content, title=f"Image {image_id}")
+    similar_strip = Div(
+        H3("More like this"),
+        Div(*[render_grid_item(similar) for similar in await store.run(store.get_images, similar_ids)], Class="image-grid"),
+        Class="similar-strip"
+    )
+    return render_page(content, similar_strip, title=f"Image {image_id}")
 
 # --- HTMX Action Endpoints ---
 
 @app.post("/like/{image_id}", response_class=HTMLResponse)
-async def like_image(image_id: int):
-    """Handle HTMX like action"""
-    if image_id not in images:
+async def like_image(image_id: int, request: Request, oob: bool = False):
+    """Handle HTMX like action; liking twice is a no-op"""
+    user_id = session_user_id(request)
+    if user_id is None:
+        return sign_up_required()
+    likes = await like_buffer.set_liked(image_id, user_id, True)
+    if likes is None:
         raise HTTPException(status_code=404, detail="Image not found")
-    images[image_id]['likes'] += 1
-
-    # Return the updated like section HTML fragment
-    def render_like_section(img_id: int, current_likes: int):
-         return Span(
-            f"{current_likes} Likes",
-            Button("Like", hx_post=f"/like/{img_id}", hx_target=f"#likes-{img_id}", hx_swap="outerHTML"),
-            Button("Unlike", hx_post=f"/unlike/{img_id}", hx_target=f"#likes-{img_id}", hx_swap="outerHTML"),
-            id=f"likes-{img_id}"
-        )
-    return HTMLResponse(str(render_like_section(image_id, images[image_id]['likes'])))
+    live_updates.publish_likes(image_id, likes)
+    if oob: # Just the regions that changed
+        return HTMLResponse(render_like_oob(image_id, likes, True))
+    return HTMLResponse(render_like_section(image_id, likes, True))
 
 
 @app.post("/unlike/{image_id}", response_class=HTMLResponse)
-async def unlike_image(image_id: int):
-    """Handle HTMX unlike action"""
-    if image_id not in images:
+async def unlike_image(image_id: int, request: Request, oob: bool = False):
+    """Handle HTMX unlike action; only removes this user's own like"""
+    user_id = session_user_id(request)
+    if user_id is None:
+        return sign_up_required()
+    likes = await like_buffer.set_liked(image_id, user_id, False)
+    if likes is None:
         raise HTTPException(status_code=404, detail="Image not found")
-    if images[image_id]['likes'] > 0:
-        images[image_id]['likes'] -= 1
-
-    # Return the updated like section HTML fragment
-    def render_like_section(img_id: int, current_likes: int):
-         return Span(
-            f"{current_likes} Likes",
-            Button("Like", hx_post=f"/like/{img_id}", hx_target=f"#likes-{img_id}", hx_swap="outerHTML"),
-            Button("Unlike", hx_post=f"/unlike/{img_id}", hx_target=f"#likes-{img_id}", hx_swap="outerHTML"),
-            id=f"likes-{img_id}"
-        )
-    return HTMLResponse(str(render_like_section(image_id, images[image_id]['likes'])))
+    live_updates.publish_likes(image_id, likes)
+    if oob: # Just the regions that changed
+        return HTMLResponse(render_like_oob(image_id, likes, False))
+    return HTMLResponse(render_like_section(image_id, likes, False))
 
 
 @app.post("/comment/{image_id}", response_class=HTMLResponse)
-async def add_comment(image_id: int, comment: str = Form(...)):
-    """Handle HTMX comment submission"""
-    if image_id not in images:
+async def add_comment(request: Request, image_id: int, comment: str = Form(...), client: str = Form("")):
+    """Handle HTMX comment submission; returns only the new comment's list item"""
+    if not comment: # Ignore empty comments
+        return HTMLResponse("")
+    user_id = session_user_id(request)
+    author = await store.run(store.get_username, user_id) if user_id is not None else None
+    posted = await store.run(store.add_comment, image_id, comment, author)
+    if posted is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    item = render_comment(posted)
+    live_updates.publish_comment(image_id, item, client, posted["id"])
+    await sync_comments() # Indexes this comment, and any posted through other workers since
+    return HTMLResponse(item)
+
+
+@app.get("/comments/{image_id}", response_class=HTMLResponse)
+async def comments_page(image_id: int, before: Optional[int] = None, limit: int = COMMENTS_PAGE_SIZE):
+    """Older comments for the "load more" button"""
+    items = await render_comment_items(image_id, before, max(1, min(limit, FEED_MAX_PAGE_SIZE)))
+    if items is None:
         raise HTTPException(status_code=404, detail="Image not found")
-    if comment: # Add non-empty comments
-        images[image_id]['comments'].append(comment)
+    return HTMLResponse("".join(items))
 
-    # Return the updated comments list HTML fragment
-    def render_comments_list(img_id: int, comments: List[str]):
-        list_items = [Li(c) for c in comments] if comments else [Li("No comments yet.")]
-        return Ul(*list_items, id=f"comments-list-{img_id}", Class="comments-list")
 
-    return HTMLResponse(str(render_comments_list(image_id, images[image_id]['comments'])))
+@app.get("/image/{image_id}/events")
+async def image_events(image_id: int, client: str = ""):
+    """Server-Sent Events stream of like counts and new comments for one image"""
+    if await store.run(store.get_image, image_id, with_comments=False) is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if live_updates.connections >= LIVE_MAX_CONNECTIONS:
+        raise HTTPException(status_code=503, detail="Too many live connections")
+    return StreamingResponse(
+        live_updates.stream(image_id, client), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Don't let proxies buffer the stream
+    )
 
 
 @app.get("/post-form", response_class=HTMLResponse)
@@ -231,7 +3168,7 @@ async def get_post_form():
     form_content = Div(
         Div(
             H2("Create New Post"),
-            Form(
+            HtmlForm(
                 P(Label("Choose Image:", fr="image_file"), Input(type="file", id="image_file", name="image_file", accept="image/*", required=True)),
                 P(Label("Description:", fr="description"), Textarea(id="description", name="description", rows="4", required=True)),
                 Button("Post Image", type="submit"),
@@ -246,7 +3183,7 @@ async def get_post_form():
         # Optional: click outside modal to close
         # hx_get="/close-modal", hx_target="#modal-container", hx_swap="innerHTML", hx_trigger="click from:body"
     )
-    return HTMLResponse(str(form_content))
+    return HTMLResponse(to_xml(form_content))
 
 
 @app.get("/close-modal", response_class=HTMLResponse)
@@ -255,28 +3192,78 @@ async def close_modal():
     return HTMLResponse("")
 
 
+@app.get("/objects/{name}")
+async def get_object(name: str):
+    """Serve a stored blob; the name is its SHA-256 plus the image extension"""
+    digest = os.path.splitext(name)[0]
+    if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+        raise HTTPException(status_code=404, detail="Object not found")
+    path = object_store.path_for(digest)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Object not found")
+    # Content-addressed, so the bytes behind a URL never change
+    return FileResponse(path, media_type=mimetypes.guess_type(name)[0], headers={"Cache-Control": IMMUTABLE_CACHE})
+
+
+@app.post("/delete/{image_id}")
+async def delete_image(image_id: int, request: Request):
+    """Delete an image the signed-in user uploaded; its blob is removed only when no other
+    image references it. The session cookie is SameSite=Lax, so other sites cannot post here
+    on the user's behalf."""
+    img_data = await store.run(store.get_image, image_id, with_comments=False)
+    if img_data is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    user_id = session_user_id(request)
+    if user_id is None or img_data['owner'] != user_id:
+        raise HTTPException(status_code=403, detail="Only the uploader can delete this image")
+    img_data = await store.run(store.delete_image, image_id)
+    if img_data is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    forget_image(image_id)
+    page_cache.invalidate()
+    if img_data['blob']:
+        await run_in_threadpool(object_store.release, img_data['blob'], store)
+    for url in img_data['variants'].values():
+        await run_in_threadpool(object_store.release, digest_from_url(url), store)
+    return RedirectResponse(url="/", status_code=303)
+
+
+@app.get("/metrics/storage")
+async def storage_metrics():
+    """Object store usage; dedup_ratio is bytes uploaded per byte stored"""
+    stats = await store.run(store.blob_stats)
+    stats["dedup_ratio"] = round(stats["logical_bytes"] / stats["physical_bytes"], 3) if stats["physical_bytes"] else 1.0
+    return stats
+
+
 @app.post("/upload")
-async def handle_upload(description: str = Form(...), image_file: UploadFile = File(...)):
+async def handle_upload(request: Request, description: str = Form(...), image_file: UploadFile = File(...)):
     """Handle the image upload form submission"""
-    global next_image_id
     print(f"Received upload: {image_file.filename}, Description: {description}")
 
-    # --- Simulate saving and adding ---
-    # In a real app:
-    # 1. Generate a unique filename
-    # 2. Save the file: content = await image_file.read(); with open(save_path, "wb") as f: f.write(content)
-    # 3. Store file path or URL in the database along with description
-
-    new_id = next_image_id
-    images[new_id] = {
-        "id": new_id,
-        # Use a placeholder, or ideally store and serve the actual uploaded image
-        "url": f"https://via.placeholder.com/300x200.png?text=New+Post+{new_id}",
-        "description": description,
-        "likes": 0,
-        "comments": []
-    }
-    next_image_id += 1
+    ext = sniff_image_type(await image_file.read(16))
+    if ext is None:
+        raise HTTPException(status_code=400, detail="Unsupported image type")
+    await image_file.seek(0)
+    try:
+        digest, size, deduplicated = await object_store.put_stream(image_file, store)
+    except ObjectTooLarge:
+        raise HTTPException(status_code=413, detail="Image too large")
+    print(f"Stored upload as {digest} ({size} bytes{', deduplicated' if deduplicated else ''})")
+
+    try:
+        width, height = await run_in_threadpool(read_dimensions, object_store.path_for(digest))
+        new_id = await store.run(store.add_image, object_url(digest, ext), description, blob=digest, width=width,
+                                 height=height, owner=session_user_id(request))
+    except BaseException: # No image points at the blob yet, so drop the reference put_stream added
+        await run_in_threadpool(object_store.release, digest, store)
+        raise
+    feed_index.add(new_id)
+    search_index.add_text(new_id, description)
+    page_cache.invalidate()
+    # Thumbnails and features are computed in the background, or copied from an earlier upload of the same file
+    if not (deduplicated and await reuse_analysis(new_id, digest)):
+        schedule_analysis(new_id, digest)
 
     # Indicate success. The HTMX form handler will trigger a redirect on success (status 200).
     # Alternatively, send an HTMX response header to redirect:
@@ -0,0 +1,316 @@
+"""Micro-benchmarks for the hot paths in app.py.py
+
+Usage: python benchmarks.py [name ...]   (runs every benchmark when no name is given)
+"""
+import asyncio
+import importlib.util
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py.py")
+
+
+def load_app():
+    """Import app.py.py as a module (its file name is not importable directly)"""
+    spec = importlib.util.spec_from_file_location("pinterest_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(fn, repeat=2000):
+    """Average seconds per call over repeat calls"""
+    fn() # Warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def report(label, seconds):
+    print(f"  {label:<40} {seconds * 1e6:10.1f} us")
+
+
+# --- Benchmarks ---
+
+def bench_render_page(app):
+    """Full page render: whole FastHTML tree + to_xml() vs the pre-rendered shell"""
+    content = (app.Div(app.H2("Image Details"), app.P("A lovely placeholder")),)
+    before = timed(lambda: app.HTMLResponse(app.to_xml(app.build_page(*content, title="Feed"))))
+    after = timed(lambda: app.render_page(*content, title="Feed"))
+    report("build_page tree + to_xml() (before)", before)
+    report("render_page with cached shell (after)", after)
+    print(f"  speedup: {before / after:.1f}x")
+
+
+def bench_image_memory(app, pins=int(os.environ.get("BENCH_PINS", "1000000"))):
+    """Bytes per pin held by the in-memory store: per-image dicts vs slotted ImageRecords"""
+    def synthetic_dicts():
+        return {
+            i: {"id": i, "url": f"/objects/{i:064x}.jpg", "description": f"Synthetic pin {i}", "likes": i % 50,
+                "comments": [], "blob": None, "width": None, "height": None, "variants": {}}
+            for i in range(1, pins + 1)
+        }
+
+    def synthetic_records():
+        repo = app.InMemoryRepository()
+        for i in range(1, pins + 1):
+            repo.add_image(f"/objects/{i:064x}.jpg", f"Synthetic pin {i}", likes=i % 50)
+        return repo
+
+    for label, build in (("dict records (before)", synthetic_dicts), ("ImageRecord (after)", synthetic_records)):
+        tracemalloc.start()
+        kept = build()
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        print(f"  {label:<40} {used / pins:10.1f} bytes/pin at {pins:,} pins")
+
+
+def synthetic_descriptions(pins, seed=0):
+    """Short descriptions drawn from a skewed vocabulary, like real pin captions"""
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(20000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    for _ in range(pins):
+        yield " ".join(rng.choices(vocabulary, weights, k=rng.randint(3, 12)))
+
+
+def bench_search(app, pins=int(os.environ.get("BENCH_PINS", "1000000"))):
+    """BM25 query latency over the inverted index vs a linear scan of descriptions"""
+    index = app.SearchIndex()
+    descriptions = []
+    for image_id, text in enumerate(synthetic_descriptions(pins), start=1):
+        index.add_text(image_id, text)
+        descriptions.append(text)
+    queries = ["word150 word2000", "word9000", "word40 word700 word15000"]
+
+    def linear_scan():
+        for query in queries:
+            terms = set(app.tokenize(query))
+            [i for i, text in enumerate(descriptions) if terms & set(app.tokenize(text))]
+
+    report(f"linear scan, {len(queries)} queries (before)", timed(linear_scan, repeat=1))
+    report(f"SearchIndex.search, {len(queries)} queries (after)", timed(lambda: [index.search(q) for q in queries], repeat=20))
+
+
+def bench_autocomplete(app, pins=int(os.environ.get("BENCH_PINS", "1000000"))):
+    """Per-keystroke suggestion cost from the prefix index"""
+    index = app.SearchIndex()
+    for image_id, text in enumerate(synthetic_descriptions(pins), start=1):
+        index.add_text(image_id, text)
+    prefixes = app.PrefixIndex()
+    prefixes.rebuild({term: len(docs) for term, docs in index.postings.items()})
+    for typed in ("w", "wo", "wor", "word1", "word12", "word123"):
+        report(f"suggest({typed!r})", timed(lambda: prefixes.suggest(typed), repeat=20000))
+    # A weight change clears the cached results along its term's path, so the next keystroke walks the trie
+    weight = prefixes.weights["word123"]
+    for typed in ("w", "word1", "word123"):
+        report(f"suggest({typed!r}) after an update", timed(lambda: (prefixes.set_weight("word123", weight), prefixes.suggest(typed)), repeat=5000))
+
+
+def bench_vector_recall(app, vectors=int(os.environ.get("BENCH_VECTORS", "200000")), queries=100, k=10):
+    """Recall@k and per-query latency of the IVF index against exact matrix-product search"""
+    np = app.np
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((500, app.FEATURE_DIM), dtype=np.float32)
+    data = centers[rng.integers(0, len(centers), vectors)] + 0.4 * rng.standard_normal((vectors, app.FEATURE_DIM), dtype=np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+
+    exact = app.VectorIndex(capacity=vectors)
+    for image_id, vector in enumerate(data, start=1):
+        exact.add(image_id, vector)
+    ivf = app.IVFIndex(tempfile.mkdtemp(prefix="bench-ivf-"), capacity=vectors)
+    ivf.bulk_load(enumerate(data, start=1))
+    query_vectors = data[rng.choice(vectors, queries, replace=False)]
+
+    truth = [{image_id for image_id, _ in result} for result in exact.search(query_vectors, k)]
+    report(f"exact, {vectors:,} vectors", timed(lambda: exact.search(query_vectors[:1], k), repeat=50))
+    for nprobe in (1, 4, 8, 16, 32):
+        found = ivf.search(query_vectors, k, nprobe=nprobe)
+        recall = sum(len(truth_ids & {image_id for image_id, _ in result}) for truth_ids, result in zip(truth, found)) / (k * queries)
+        latency = timed(lambda: ivf.search(query_vectors[:1], k, nprobe=nprobe), repeat=200)
+        report(f"IVF {len(ivf.centroids)} lists, nprobe={nprobe:<3} recall={recall:.3f}", latency)
+
+
+def like_worker(app, db_path, image_id, worker, hits, start, atomic):
+    """One worker process hammering a single image's like count: each step is a new user's
+    like, every fourth step takes back the like made just before it"""
+    repo = app.SQLiteRepository(db_path)
+    start.wait()
+    for i in range(hits):
+        liked = i % 4 != 3
+        user_id = worker * hits + (i if liked else i - 1)
+        if atomic:
+            repo.apply_like_changes({(image_id, user_id): liked})
+        else: # The old handler pattern: read, modify in Python, write back
+            likes = repo.get_image(image_id)["likes"]
+            repo.conn.execute("UPDATE images SET likes = ? WHERE id = ?", (likes + (1 if liked else -1), image_id))
+
+
+def bench_like_stress(app, workers=8, hits=2000):
+    """Concurrent like/unlike from several processes against one SQLite row; fails on lost updates"""
+    fork = multiprocessing.get_context("fork")
+    initial = 1000000 # High enough that the clamp at zero never applies
+    expected = initial + workers * sum(-1 if i % 4 == 3 else 1 for i in range(hits))
+    for atomic, label in ((False, "read-modify-write (before)"), (True, "apply_like_changes (after)")):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench-likes-"), "likes.db")
+        image_id = app.SQLiteRepository(db_path).add_image("/objects/x.jpg", "stress", likes=initial)
+        start = fork.Barrier(workers)
+        procs = [fork.Process(target=like_worker, args=(app, db_path, image_id, w, hits, start, atomic)) for w in range(workers)]
+        began = time.perf_counter()
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        elapsed = time.perf_counter() - began
+        actual = app.SQLiteRepository(db_path).get_image(image_id)["likes"]
+        print(f"  {label:<40} expected {expected}, got {actual}, lost {expected - actual}, {workers * hits / elapsed:,.0f} ops/s")
+        if atomic and actual != expected:
+            raise AssertionError(f"Lost like updates: expected {expected}, got {actual}")
+
+
+def hot_like_worker(app, db_path, image_id, worker, flushes, batch, start, latencies):
+    """One worker process flushing batches of new likes on a single image, like LikeBuffer does"""
+    repo = app.SQLiteRepository(db_path)
+    start.wait()
+    timings = []
+    for flush in range(flushes):
+        users = range((worker * flushes + flush) * batch + 1, (worker * flushes + flush + 1) * batch + 1)
+        began = time.perf_counter()
+        repo.apply_like_changes({(image_id, user_id): True for user_id in users})
+        timings.append(time.perf_counter() - began)
+    latencies.extend(timings)
+
+
+def bench_hot_likes(app, workers=8, likes=5000, batch=250):
+    """Write throughput for one viral image from several workers: one transaction per click
+    vs LikeBuffer-style flushes, where each worker's buffer is its own sub-counter summed
+    into one row update; fails if any like is lost"""
+    fork = multiprocessing.get_context("fork")
+    for size, label in ((1, "one write per click (before)"), (batch, f"flushes of {batch} (after)")):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench-hot-"), "likes.db")
+        repo = app.SQLiteRepository(db_path)
+        image_id = repo.add_image("/objects/x.jpg", "viral", likes=0)
+        start = fork.Barrier(workers)
+        latencies = fork.Manager().list()
+        procs = [fork.Process(target=hot_like_worker, args=(app, db_path, image_id, w, likes // size, size, start, latencies)) for w in range(workers)]
+        began = time.perf_counter()
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        elapsed = time.perf_counter() - began
+        latencies = sorted(latencies)
+        expected = workers * (likes // size) * size
+        actual = repo.get_image(image_id)["likes"]
+        print(f"  {label:<40} p50 {latencies[len(latencies) // 2] * 1e3:6.2f} ms  p99 {latencies[int(len(latencies) * 0.99)] * 1e3:6.2f} ms"
+              f"  {expected / elapsed:,.0f} likes/s")
+        if actual != expected:
+            raise AssertionError(f"Lost likes: expected {expected}, got {actual}")
+
+
+def bench_sse_fanout(app, connections=int(os.environ.get("BENCH_CONNECTIONS", "5000"))):
+    """Memory per idle SSE subscriber on one image, and time to fan one push out to all of them"""
+    async def run():
+        live = app.LiveUpdates()
+        received = 0
+        everyone = asyncio.Event()
+
+        async def viewer():
+            nonlocal received
+            async for message in live.stream(1):
+                if "event: likes" in message:
+                    received += 1
+                    if received == connections:
+                        everyone.set()
+
+        tracemalloc.start()
+        viewers = [asyncio.create_task(viewer()) for _ in range(connections)]
+        await asyncio.sleep(0.1) # Let every viewer reach its wait
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        began = time.perf_counter()
+        live.publish_likes(1, 42)
+        await everyone.wait()
+        elapsed = time.perf_counter() - began
+        for task in viewers:
+            task.cancel()
+        await asyncio.gather(*viewers, return_exceptions=True)
+        print(f"  {'idle subscriber':<40} {used / connections:10.0f} bytes each at {connections:,} connections")
+        report(f"push to all {connections:,} subscribers", elapsed)
+
+    asyncio.run(run())
+
+
+def bench_like_bytes(app, clicks=200):
+    """Response bytes per like/unlike click: the whole like section vs out-of-band count and badge"""
+    from starlette.testclient import TestClient
+    with TestClient(app.app) as client:
+        client.post("/signup", data={"username": "bench", "email": "bench@example.com", "password": "bench"})
+        image_id = app.store.image_ids()[0]
+        for mode, label in (("", "like section (before)"), ("?oob=1", "hx-swap-oob count + badge (after)")):
+            sent = sum(len(client.post(f"/{verb}/{image_id}{mode}").content)
+                       for _ in range(clicks // 2) for verb in ("like", "unlike"))
+            print(f"  {label:<40} {sent / clicks:10.1f} bytes/click")
+
+
+def bench_fragments(app):
+    """Hot HTMX fragments: FastHTML tree + to_xml() per call vs the precompiled string templates"""
+    comment = {"id": 1, "body": "Lovely colours", "author": "bench", "created_at": 1700000000.0}
+    posted = time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime(comment["created_at"]))
+    cases = [
+        ("like section", lambda: app.to_xml(app.like_section_tree(42, 1234, app.LIKED_BADGE)), lambda: app.render_like_section(42, 1234, True)),
+        ("like oob", lambda: "".join(map(app.to_xml, app.like_oob_tree(42, 1234, app.LIKED_BADGE))), lambda: app.render_like_oob(42, 1234, True)),
+        ("comment", lambda: app.to_xml(app.comment_tree(comment["author"], comment["body"], posted)), lambda: app.render_comment(comment)),
+    ]
+    for label, tree, template in cases:
+        before, after = timed(tree, repeat=20000), timed(template, repeat=20000)
+        report(f"{label}: tree + to_xml() (before)", before)
+        report(f"{label}: template (after)", after)
+        print(f"  speedup: {before / after:.1f}x")
+
+
+def bench_feed_cache(app):
+    """First feed page: full render vs page cache hit"""
+    from starlette.requests import Request
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""})
+    loop = asyncio.new_event_loop()
+
+    def rendered():
+        app.page_cache.invalidate()
+        loop.run_until_complete(app.feed_page(request))
+
+    before = timed(rendered, repeat=500)
+    after = timed(lambda: loop.run_until_complete(app.feed_page(request)), repeat=5000)
+    loop.close()
+    report("render feed page (before)", before)
+    report("page cache hit (after)", after)
+    print(f"  speedup: {before / after:.1f}x")
+
+
+BENCHMARKS = {
+    "render_page": bench_render_page,
+    "image_memory": bench_image_memory,
+    "search": bench_search,
+    "autocomplete": bench_autocomplete,
+    "vector_recall": bench_vector_recall,
+    "like_stress": bench_like_stress,
+    "hot_likes": bench_hot_likes,
+    "sse_fanout": bench_sse_fanout,
+    "like_bytes": bench_like_bytes,
+    "fragments": bench_fragments,
+    "feed_cache": bench_feed_cache,
+}
+
+
+if __name__ == "__main__":
+    app = load_app()
+    for name in sys.argv[1:] or list(BENCHMARKS):
+        print(name)
+        BENCHMARKS[name](app)